@@ -1,8 +1,24 @@
-import numpy as np
-import pygame
-import random
+import time
+# Start of the process as seen by the game, for --startup-time
+START_TIME = time.perf_counter()
 import sys
-import json
+import argparse
+import colorsys
+from lazyimport import lazy_import
+from core import GameCore, ENGINES, ROWS, MAX_SIZE
+from stats import StatsStore, DB_PATH
+from instrument import INSTRUMENTS, EXPORT_INTERVAL, profile_session
+from fonts import FontCache
+from history import HistoryRing, pack_cells, words_for, CELL_BITS, DEPTH
+from rng import RngStream
+
+# pygame is loaded when the window is opened, the recorder and the bitboard
+# tables only when games are recorded or hints asked for, and the search (with
+# its heuristic tables) when the first hint is asked for
+pygame = lazy_import("pygame")
+recording = lazy_import("recording")
+bitboard = lazy_import("bitboard")
+hints = lazy_import("hints")
 
 # define sizes
 WIDTH, HEIGHT = 567, 638
@@ -10,8 +26,9 @@ BOARD_WIDTH, BOARD_HEIGHT = 380, 380
 X_SHIFT, X_SHIFT2, X_SHIFT3 = 90, 190, 257
 Y_SHIFT, Y_SHIFT2, Y_SHIFT3 = 20, 85, 144
 GAP = 8
+# Undo and Redo buttons, under the board
+HISTORY_BTN_Y, HISTORY_BTN_HEIGHT = Y_SHIFT3 + BOARD_HEIGHT + GAP, 35
 TILE_SIZE = (BOARD_WIDTH - 5 * GAP)//4
-COLS, ROWS = 4, 4
 
 # main colors
 WHITE = (255, 255, 255)
@@ -20,6 +37,11 @@ BOARD_COLOR = (173, 157, 143)
 GAME_LABEL_COLOR = (140, 123, 105)
 TRANSPARENT_ALPHA = 210
 
+# frame rate limit while something is animating
+FPS = 60
+# seconds between two moves of the autoplay
+AUTOPLAY_DELAY = 0.15
+
 # tiles colors
 TILES_COLORS = {
     0: (194, 178, 166),
@@ -56,45 +78,58 @@ LABELS_COLORS = {
     8192: WHITE,
 }
 
+# Tile and label colors of any power of two. Tiles past the table get a new
+# dark hue for every power of two.
+def tile_colors(tile_num):
+    if tile_num in TILES_COLORS:
+        return TILES_COLORS[tile_num], LABELS_COLORS[tile_num]
+    hue = (tile_num.bit_length() * 0.13) % 1.0
+    red, green, blue = colorsys.hls_to_rgb(hue, 0.25, 0.45)
+    return (int(red * 255), int(green * 255), int(blue * 255)), WHITE
+
 # Manages the game score, high score, and the number of rounds played
 class ScoreManager:
 
-    # Initializes the ScoreManager with default values and loads previous data
-    def __init__(self):
+    # Initializes the ScoreManager with default values and loads previous data.
+    # A 2048.json from an older version is imported into the database once.
+    def __init__(self, path=DB_PATH, json_path="2048.json"):
         self.score = 0
         self.best = 0
         self.played_round = 0
+        # Finished games and counters, written by a background thread
+        self.stats = StatsStore(path, json_path)
         self.load_data()
 
-    # Loads high score and played rounds from a JSON file
+    # Loads high score and played rounds from the database
     def load_data(self):
-        try:
-            with open("2048.json", "r") as file:
-                data = json.load(file)
-                self.best = data.get("best_score", 0)
-                print("Best score loaded:", self.best)
-                self.played_round = data.get("played_round", 0)
-                print("Round played before:", self.played_round)
-
-        except FileNotFoundError:
-            print("No previous data found. Starting with default values.")
-    
-    # save high score and played rounds in a JSON file
+        self.best = self.stats.get_value("best_score", 0)
+        print("Best score loaded:", self.best)
+        self.played_round = self.stats.get_value("played_round", 0)
+        print("Round played before:", self.played_round)
+
+    # Queue high score and played rounds for the database, never waits for the write
     def save_data(self):
-        with open("2048.json", "w") as file:
-            json.dump({"best_score": self.best, "played_round": self.played_round}, file)
+        self.stats.set_values({"best_score": self.best, "played_round": self.played_round})
+
+    # Wait until everything queued is in the database
+    def flush(self):
+        self.stats.flush()
 
-    # Checks if the current score is higher than the best score and updates the JSON file
+    # Checks if the current score is higher than the best score and queues it for the database
     def check_highscore(self):
-        if self.score >= self.best:
+        if self.score > self.best:
             self.best = self.score
             self.save_data()
-            print("New best score saved:", self.best)
-                
-    # Updates the number of rounds played and saves it to the JSON file
+
+    # Queue a finished game for the database
+    def record_game(self, max_tile, moves, duration, seed=None):
+        self.stats.record_game(self.score, max_tile, moves, duration, seed)
+
+    # Updates the number of rounds played and saves it to the database
     def played_round_updater(self):
         self.played_round += 1
         self.save_data()
+        self.flush()
         print("New round played saved:", self.played_round)
 
     # Resets the score for a new game and increments the played rounds
@@ -112,47 +147,292 @@ class ScoreManager:
         self.save_data()
         print("Score reset to 0 and played rounds reset 0.")
 
+# Collects the screen areas changed since the last display update
+class DirtyTracker:
+
+    def __init__(self):
+        # The first update covers the whole screen
+        self.rects = [pygame.Rect(0, 0, WIDTH, HEIGHT)]
+        # Set when the whole board has to be drawn again
+        self.redraw_board = True
+
+    # Mark an area of the screen as changed
+    def add(self, rect):
+        self.rects.append(pygame.Rect(rect))
+
+    # Send the changed areas to the display, nothing is sent on an idle frame
+    def flush(self):
+        if self.rects:
+            pygame.display.update(self.rects)
+            self.rects = []
+
+# Paces the main loop: blocks on input while nothing is animating, otherwise
+# limits the frame rate. Also measures the time and CPU spent on every frame.
+class FrameScheduler:
+
+    def __init__(self, fps=FPS, timeout=None):
+        self.fps = fps
+        # Longest wait for input in seconds, None waits forever
+        self.timeout = timeout
+        self.clock = pygame.time.Clock()
+        self.animating = False #if true the loop keeps running at fps
+        # Frame statistics (seconds), work time excludes the time waiting for input
+        self.frames = 0
+        self.frame_time = 0.0
+        self.cpu_time = 0.0
+        self.total_frame_time = 0.0
+        self.total_cpu_time = 0.0
+        self.__start_frame()
+
+    def __start_frame(self):
+        self.frame_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+
+    # Events of the next frame, waits for the first one when nothing is animating
+    def events(self):
+        if self.animating:
+            self.clock.tick(self.fps)
+            events = pygame.event.get()
+        else:
+            if self.timeout is None:
+                first = pygame.event.wait()
+            else:
+                first = pygame.event.wait(int(self.timeout * 1000))
+            events = [first] + pygame.event.get()
+        self.__start_frame()
+        return events
+
+    # Record the time spent on the frame that just ended
+    def end_frame(self):
+        self.frame_time = time.perf_counter() - self.frame_start
+        self.cpu_time = time.process_time() - self.cpu_start
+        self.total_frame_time += self.frame_time
+        self.total_cpu_time += self.cpu_time
+        self.frames += 1
+
+    # Average frame and CPU time per frame in milliseconds
+    def report(self):
+        frames = max(self.frames, 1)
+        return (f"{self.frames} frames, {1000 * self.total_frame_time / frames:.3f} ms per frame, "
+                f"{1000 * self.total_cpu_time / frames:.3f} ms CPU per frame")
+
+# Shows the slowest instrumented paths under the board (toggled with F3)
+class InstrumentOverlay:
+
+    def __init__(self, screen, fonts):
+        self.screen = screen
+        self.font = fonts.get(12)
+        self.visible = False
+        top = HISTORY_BTN_Y + HISTORY_BTN_HEIGHT + GAP
+        self.rect = pygame.Rect(X_SHIFT, top, BOARD_WIDTH, HEIGHT - top)
+
+    # Show or hide the overlay
+    def toggle(self, dirty):
+        self.visible = not self.visible
+        pygame.draw.rect(self.screen, SCREEN_COLOR, self.rect)
+        dirty.add(self.rect)
+
+    # Draw the current stats
+    def draw(self, dirty):
+        if not self.visible: return
+        pygame.draw.rect(self.screen, SCREEN_COLOR, self.rect)
+        line_y = self.rect.y
+        for line in INSTRUMENTS.summary(limit=self.rect.height // self.font.get_linesize()):
+            self.screen.blit(self.font.render(line, 1, GAME_LABEL_COLOR), (self.rect.x, line_y))
+            line_y += self.font.get_linesize()
+        dirty.add(self.rect)
+
+# Arrow of the hinted direction and the autoplay state, left of the board
+class HintOverlay:
+
+    # Unit vector of every direction, on the screen
+    VECTORS = {'UP': (0, -1), 'DOWN': (0, 1), 'LEFT': (-1, 0), 'RIGHT': (1, 0)}
+
+    def __init__(self, screen, fonts):
+        self.screen = screen
+        self.font = fonts.get(15, bold=True)
+        side = X_SHIFT - 4 * GAP
+        self.rect = pygame.Rect(2 * GAP, Y_SHIFT3, side, side + self.font.get_linesize() + GAP)
+        self.box = pygame.Rect(2 * GAP, Y_SHIFT3, side, side)
+        # (direction, thinking, autoplay) on the screen
+        self.shown = None
+
+    def text(self, label, center):
+        text = self.font.render(label, 1, GAME_LABEL_COLOR)
+        self.screen.blit(text, (center[0] - text.get_width()//2, center[1] - text.get_height()//2))
+
+    # Draw the hint (None for no hint) and whether one is being searched, only when they changed
+    def draw(self, dirty, direction, thinking, autoplay):
+        if (direction, thinking, autoplay) == self.shown: return
+        self.shown = (direction, thinking, autoplay)
+        pygame.draw.rect(self.screen, SCREEN_COLOR, self.rect)
+        if direction is not None:
+            # Triangle pointing from the center of the box towards the direction
+            pygame.draw.rect(self.screen, BOARD_COLOR, self.box, border_radius=GAP)
+            (dx, dy), (cx, cy) = self.VECTORS[direction], self.box.center
+            radius = self.box.width // 3
+            pygame.draw.polygon(self.screen, WHITE, [
+                (cx + dx * radius, cy + dy * radius),
+                (cx - dx * radius//2 - dy * radius, cy - dy * radius//2 + dx * radius),
+                (cx - dx * radius//2 + dy * radius, cy - dy * radius//2 - dx * radius),
+            ])
+        elif thinking:
+            self.text("...", self.box.center)
+        if autoplay:
+            self.text("Auto", (self.rect.centerx, self.box.bottom + GAP + self.font.get_linesize()//2))
+        dirty.add(self.rect)
+
+# Hints (H) and autoplay (A). The expectimax search runs on a HintWorker
+# thread and the loop only reads its finished results, so a frame never waits
+# for the search; hints are cached by board, so going back to a position
+# shows its hint at once.
+class Assistant:
+
+    def __init__(self, game, overlay, delay=AUTOPLAY_DELAY, notify=None):
+        self.game = game
+        self.overlay = overlay
+        self.delay = delay
+        # Called from the worker thread when a search is done
+        self.notify = notify
+        # Started the first time a hint is needed
+        self.worker = None
+        # Board the hint was asked for, it's shown as long as the board doesn't change
+        self.hint_board = None
+        self.autoplay = False
+        self.last_move = 0.0
+
+    # The search plays on bitboards, 4x4 only
+    def available(self):
+        if (self.game.rows, self.game.cols) == (ROWS, ROWS): return True
+        print(f"Hints need a {ROWS}x{ROWS} board")
+        return False
+
+    def start(self):
+        # hints and the modules it uses are loaded here, on the main thread, before the worker thread starts
+        if self.worker is None: self.worker = hints.HintWorker(notify=self.notify)
+
+    # Show the hint for the current board
+    def hint(self):
+        if not self.available(): return
+        self.start()
+        self.hint_board = bitboard.pack(self.game.tiles)
+
+    # Start or stop playing the hinted moves
+    def toggle_autoplay(self):
+        if not self.autoplay and not self.available(): return
+        self.start()
+        self.autoplay = not self.autoplay
+
+    # Once a frame: take the finished searches, play the next autoplay move
+    # when it is known and its time has come, then draw the hint
+    def update(self, dirty):
+        direction, thinking = None, False
+        if self.worker is not None:
+            self.worker.poll()
+            # Autoplay stops with the game
+            if self.game.gui.menu.visible(): self.autoplay = False
+            if self.autoplay and time.perf_counter() - self.last_move >= self.delay:
+                move = self.worker.request(bitboard.pack(self.game.tiles))
+                if move is not None:
+                    self.game.play_move(move)
+                    self.last_move = time.perf_counter()
+            # The hint of the current board, its search starts now if it isn't cached
+            board = bitboard.pack(self.game.tiles)
+            if self.autoplay or board == self.hint_board:
+                direction = self.worker.request(board)
+                thinking = direction is None and self.worker.searching()
+            else:
+                self.worker.cancel()
+        self.overlay.draw(dirty, direction, thinking, self.autoplay)
+
+    def close(self):
+        if self.worker is not None: self.worker.close()
+
+# Renders every tile value once and keeps the surface
+class TileCache:
+
+    def __init__(self, font, tile_size=TILE_SIZE):
+        self.font = font
+        self.tile_size = tile_size
+        self.surfaces = {}
+
+    # Surface of a tile with its label, rendered on first use
+    def get(self, tile_num):
+        surface = self.surfaces.get(tile_num)
+        if surface is None:
+            size = self.tile_size
+            tile_color, tile_label_color = tile_colors(tile_num)
+            surface = pygame.Surface( (size, size) )
+            surface.fill(tile_color)
+            tile_label = self.font.render(str(tile_num), 1, tile_label_color)
+            # Shrink labels too wide for the tile
+            if tile_label.get_width() > size - 4:
+                scale = (size - 4) / tile_label.get_width()
+                tile_label = pygame.transform.smoothscale(tile_label, (size - 4, max(1, int(tile_label.get_height() * scale))))
+            surface.blit(tile_label, (size//2 - tile_label.get_width()//2, size//2 - tile_label.get_height()//2))
+            self.surfaces[tile_num] = surface
+        return surface
+
 # Manages the menu display and interactions
 class Menu:
 
      # Initializes the Menu with the screen and prepares button positions and texts
-    def __init__(self, screen):
+    def __init__(self, screen, dirty, fonts):
         # SCREEN
         self.screen = screen
-        self.gameOver_font = pygame.font.SysFont('comicsans', 30, True)
-        self.gameOver_btn_font = pygame.font.SysFont('comicsans', 18, True)
+        self.dirty = dirty
+        self.gameOver_font = fonts.get(30, bold=True)
+        self.gameOver_btn_font = fonts.get(18, bold=True)
+
+        # TRANSPARENT SCREEN, built once and reused
+        self.transparent_screen = pygame.Surface( (BOARD_WIDTH, BOARD_HEIGHT) )
+        self.transparent_screen.set_alpha( TRANSPARENT_ALPHA )
+        self.transparent_screen.fill( WHITE )
+        # Rendered menu texts
+        self.labels = {}
 
         # VARS for controling start and game over menu
         self.active = True
         self.start = True
+        self.drawn = False #True while the menu is on the screen
+
+    # Render a text once and keep it
+    def render(self, font, text, color):
+        key = (font, text, color)
+        if key not in self.labels:
+            self.labels[key] = font.render(text, 1, color)
+        return self.labels[key]
+
+    # Tells if the start or game over menu should be on the screen
+    def visible(self):
+        return self.active or self.start
 
     # GAME OVER or Start message
     def create_tryAgain_text(self,tryAgain_text):
 
         # TRANSPARENT SCREEN
-        self.transparent_screen = pygame.Surface( (BOARD_WIDTH, BOARD_HEIGHT) )
-        self.transparent_screen.set_alpha( TRANSPARENT_ALPHA )
-        self.transparent_screen.fill( WHITE )
         self.screen.blit(self.transparent_screen, (X_SHIFT, Y_SHIFT3))
 
         # GAME OVER or Start text
-        self.go_lbl = self.gameOver_font.render(tryAgain_text, 1, GAME_LABEL_COLOR)
+        self.go_lbl = self.render(self.gameOver_font, tryAgain_text, GAME_LABEL_COLOR)
         self.go_pos = (X_SHIFT + BOARD_WIDTH//2 - self.go_lbl.get_rect().width//2, Y_SHIFT3 + BOARD_HEIGHT//2 - self.go_lbl.get_rect().height//2 - 35)
         self.screen.blit(self.go_lbl, self.go_pos)
 
     # Draws the buttons on the screen
     def create_tryagain_btn(self,btn_text):
         self.tryAgain_btn = pygame.draw.rect(self.screen, GAME_LABEL_COLOR ,(X_SHIFT + BOARD_WIDTH//3, Y_SHIFT3 + BOARD_HEIGHT//2 , 125 , 40))
-        self.tryAgain_text = self.gameOver_btn_font.render(btn_text, 1, WHITE)
+        self.tryAgain_text = self.render(self.gameOver_btn_font, btn_text, WHITE)
         self.screen.blit(
             self.tryAgain_text,
             (X_SHIFT + BOARD_WIDTH//3  + 130//2 - self.tryAgain_text.get_width()//2,
               Y_SHIFT3 + BOARD_HEIGHT//2  + 40//2 - self.tryAgain_text.get_height()//2),
             )
 
-    # method for showing start and game over menus
+    # method for showing start and game over menus, drawn once until the board changes
     def show(self):
-        if self.active or self.start:
+        if self.visible() and not self.drawn:
+            self.drawn = True
+            self.dirty.add( (X_SHIFT, Y_SHIFT3, BOARD_WIDTH, BOARD_HEIGHT) )
             if self.start:
               # Start label
               self.create_tryAgain_text("Lets Start The Game!")
@@ -168,23 +448,31 @@ class Menu:
         #make game over & start menu hidden
         self.active = False #if ture shows game over menu
         self.start = False  #if true shows start menu
+        self.drawn = False
 
         pygame.draw.rect(self.screen, BOARD_COLOR, bg)
+        # the tiles under the menu have to be drawn again
+        self.dirty.redraw_board = True
 
 class GUI:
 
-    def __init__(self, screen):
-        # Initializes the GUI with necessary elements
+    def __init__(self, screen, fonts):
+        # Initializes the GUI with necessary elements, the fonts are shared with the menu and the game
         self.screen = screen
-        self.FONT = pygame.font.SysFont("comicsans", 35, bold=True)
-        self.score_font = pygame.font.SysFont("comicsans", 15, bold=True)
-        self.btn_font = pygame.font.SysFont("comicsans", 18, bold=True)
+        self.fonts = fonts
+        self.FONT = fonts.get(35, bold=True)
+        self.score_font = fonts.get(15, bold=True)
+        self.btn_font = fonts.get(18, bold=True)
+
+        # Changed screen areas and the score values currently on the screen
+        self.dirty = DirtyTracker()
+        self.shown_scores = (None, None, None)
 
          # Create a rectangle for the 'Try Again' button
         self.tryagain_btn_rect= pygame.draw.rect(self.screen, GAME_LABEL_COLOR ,(X_SHIFT + BOARD_WIDTH//3, Y_SHIFT3 + BOARD_HEIGHT//2 , 125 , 40))
 
          # Initialize the menu with the game screen
-        self.menu = Menu( screen )
+        self.menu = Menu( screen, self.dirty, fonts )
 
     # Draw the game board rectangle on the screen
     def create_board(self):
@@ -281,6 +569,28 @@ class GUI:
               Y_SHIFT2 + 40//2 - self.text_reset.get_height()//2),
         )
     
+    # Draw the 'Undo' button, under the 'New Game' button
+    def create_undo_btn(self):
+        self.undo_btn = pygame.draw.rect(self.screen, GAME_LABEL_COLOR ,(X_SHIFT2, HISTORY_BTN_Y, 137 , HISTORY_BTN_HEIGHT))
+
+        self.text_undo = self.btn_font.render("Undo", 1, WHITE)
+        self.screen.blit(
+            self.text_undo,
+            (X_SHIFT2 + 137//2 - self.text_undo.get_width()//2,
+              HISTORY_BTN_Y + HISTORY_BTN_HEIGHT//2 - self.text_undo.get_height()//2),
+        )
+
+    # Draw the 'Redo' button, under the 'Reset Game' button
+    def create_redo_btn(self):
+        self.redo_btn = pygame.draw.rect(self.screen, GAME_LABEL_COLOR ,(X_SHIFT2 + 141 , HISTORY_BTN_Y, 137 , HISTORY_BTN_HEIGHT))
+
+        self.text_redo = self.btn_font.render("Redo", 1, WHITE)
+        self.screen.blit(
+            self.text_redo,
+            (X_SHIFT2 + 141 + 137//2 - self.text_redo.get_width()//2,
+              HISTORY_BTN_Y + HISTORY_BTN_HEIGHT//2 - self.text_redo.get_height()//2),
+        )
+
     #Show initial screen elements
     def show_start(self):
         #Logo 2048 draw
@@ -297,17 +607,28 @@ class GUI:
         self.create_NewGame_btn()
         #Reset game button draw
         self.create_reset_btn()
+        #Undo and redo buttons draw
+        self.create_undo_btn()
+        self.create_redo_btn()
         #Board draw
         self.create_board()
 
-    # Update score, best score, and round played display
+    # Update score, best score, and round played display, only the boxes whose value changed
     def update_scores(self, score_value, best_value , round_played):
+        shown_score, shown_best, shown_round = self.shown_scores
         #Update score box value
-        self.create_score_box(score_value)
+        if score_value != shown_score:
+            self.create_score_box(score_value)
+            self.dirty.add( (X_SHIFT2, Y_SHIFT, 90 , 43) )
         #Update best score box value
-        self.create_best_box(best_value)
+        if best_value != shown_best:
+            self.create_best_box(best_value)
+            self.dirty.add( (X_SHIFT2 + 94, Y_SHIFT, 90 , 43) )
         #Update round played box value
-        self.create_round_box(round_played)
+        if round_played != shown_round:
+            self.create_round_box(round_played)
+            self.dirty.add( (X_SHIFT2 + 94*2, Y_SHIFT, 90 , 43) )
+        self.shown_scores = (score_value, best_value, round_played)
 
     # Listen for and handle menu and button click events
     def action_listener(self, event):
@@ -323,155 +644,228 @@ class GUI:
         
         return False
 
-class Game:
+# The game rules from core.GameCore drawn on a pygame screen
+class Game(GameCore):
 
-    def __init__(self, screen):
+    def __init__(self, screen, engine='line', size=ROWS, fonts=None, score_manager=None, undo_depth=DEPTH):
         # Initialize the game screen
         self.screen = screen
-        # Initialize the game tiles with zeros
-        self.tiles = np.zeros( (ROWS, COLS) )
         # Initialize the GUI
-        self.gui = GUI(screen)
+        self.gui = GUI(screen, fonts or FontCache())
         # Initialize the score manager
-        self.score_manager = ScoreManager()
+        self.score_manager = score_manager or ScoreManager()
+        # Initialize the game rules and tiles
+        super().__init__(engine, rows=size, cols=size)
+        # Layout scaled to the board size, the board is centered in its rectangle
+        self.gap = max(1, GAP * ROWS // size)
+        self.tile_size = (BOARD_WIDTH - (size + 1) * self.gap) // size
+        self.offset = (BOARD_WIDTH - size * self.tile_size - (size + 1) * self.gap) // 2
          # Set the font for tile labels
-        self.tiles_font = pygame.font.SysFont('comicsans', 40, bold=True)
+        self.tiles_font = self.gui.fonts.get(max(8, 40 * ROWS // size), bold=True)
+        # Pre-rendered tiles and the tile values currently on the screen
+        self.tile_cache = TileCache(self.tiles_font, self.tile_size)
+        self.drawn_tiles = None
         # Variables to control game state
-        self.generate = False #Flag of generating new tile
         self.playing = True #Flag of game continue running
-
-   # Draw the game board and tile values
+        # Moves and start time of the current game, for the stats
+        self.moves = 0
+        self.started = time.monotonic()
+        # Undo/redo history of packed boards (the current one and undo_depth
+        # before it), and the score of its current entry
+        self.history = HistoryRing(undo_depth + 1, words_for(size, size))
+        self.history_score = 0
+
+    # The score is kept by the score manager
+    @property
+    def score(self):
+        return self.score_manager.score
+
+    @score.setter
+    def score(self, value):
+        self.score_manager.score = value
+
+    # Draw the tiles that changed since the last frame
     def draw_board(self):
-        row_Shift, col_Shift = GAP, GAP
-        for row in range(ROWS):
-            for col in range(COLS):
+        dirty = self.gui.dirty
+        menu = self.gui.menu
+        if self.drawn_tiles is not None and not dirty.redraw_board and (self.tiles == self.drawn_tiles).all():
+            return
+
+        # The menu overlay is blended over the board, so under a menu the whole board is drawn again
+        redraw = dirty.redraw_board or self.drawn_tiles is None or menu.visible()
+        if redraw:
+            self.gui.create_board()
+            dirty.add(self.gui.board_rect)
+            dirty.redraw_board = False
+            menu.drawn = False
+
+        step = self.tile_size + self.gap
+        for row in range(self.rows):
+            for col in range(self.cols):
                 tile_num = int(self.tiles[row][col])
-                
-                # Draw the tile with the appropriate color
-                tile_color = TILES_COLORS[tile_num]
-                pygame.draw.rect(self.screen, tile_color, (X_SHIFT + col_Shift + col * TILE_SIZE, Y_SHIFT3 + row_Shift + row * TILE_SIZE, TILE_SIZE, TILE_SIZE))
-
-                # Draw the label (number) on the tile
-                tile_label_color = LABELS_COLORS[tile_num]
-                tile_label = self.tiles_font.render(str(tile_num), 1, tile_label_color)
-                tile_label_pos = (X_SHIFT + col_Shift + col * TILE_SIZE + TILE_SIZE//2 - tile_label.get_rect().width//2, Y_SHIFT3 + row_Shift + row * TILE_SIZE + TILE_SIZE//2 - tile_label.get_rect().height//2)
-                self.screen.blit(tile_label, tile_label_pos)
+                if not redraw and tile_num == self.drawn_tiles[row][col]: continue
 
-                col_Shift += GAP
+                # Draw the tile with its label from the cache
+                tile_pos = (X_SHIFT + self.offset + self.gap + col * step, Y_SHIFT3 + self.offset + self.gap + row * step)
+                self.screen.blit(self.tile_cache.get(tile_num), tile_pos)
+                if not redraw: dirty.add( (tile_pos[0], tile_pos[1], self.tile_size, self.tile_size) )
 
-            row_Shift += GAP
-            col_Shift = GAP
+        self.drawn_tiles = self.tiles.copy()
 
-    # Generate new tiles in empty positions
-    def generate_tiles(self, first=False):
-        empty_tiles = []
-
-        for row in range(ROWS):
-            for col in range(COLS):
-                if self.tiles[row][col] == 0: empty_tiles.append( (row, col) )
-        
-        empty_tile_index = random.randrange(0, len(empty_tiles))
-        row, col = empty_tiles[empty_tile_index]
-        ranndom_num = random.randint(1, 10)
-        tile_value = 2 if first or ranndom_num <= 7 else 4
-        self.tiles[row][col] = tile_value
-
-    # Move and merge tiles based on the direction
-    def __move_and_merge(self, direction, row, col):
-        dx, dy = 0, 0
-        if direction == 'UP': dy = -1
-        elif direction == 'DOWN': dy = 1
-        elif direction == 'RIGHT': dx = 1
-        elif direction == 'LEFT': dx = -1
-
-        try:
-            # Move tiles
-            if self.tiles[row + dy][col + dx] == 0:
-                value = self.tiles[row][col]
-                self.tiles[row][col] = 0
-                self.tiles[row + dy][col + dx] = value
-                self.generate = True
-                self.__move_and_merge(direction, row + dy, col + dx)
-            # Merge tiles
-            elif self.tiles[row][col] == self.tiles[row + dy][col + dx]:
-                self.tiles[row][col] = 0
-                self.tiles[row + dy][col + dx] *= 2
-                self.score_manager.score += int(self.tiles[row + dy][col + dx])
-                self.generate = True
-        except IndexError: return
-
-    # Slide tiles based on the direction
+    # Count the moves that changed the board
     def slide_tiles(self, direction):
-        
-        if direction == 'UP':
-            for row in range(1, ROWS):
-                for col in range(COLS):
-                    if self.tiles[row][col] != 0: self.__move_and_merge(direction, row, col)
-
-        if direction == 'DOWN':
-            for row in range(ROWS-2, -1, -1):
-                for col in range(COLS):
-                    if self.tiles[row][col] != 0: self.__move_and_merge(direction, row, col)
-
-        if direction == 'RIGHT':
-            for row in range(ROWS):
-                for col in range(COLS-2, -1, -1):
-                    if self.tiles[row][col] != 0: self.__move_and_merge(direction, row, col)
-
-        if direction == 'LEFT':
-            for row in range(ROWS):
-                for col in range(1, COLS):
-                    if self.tiles[row][col] != 0: self.__move_and_merge(direction, row, col)
-
-    # Check if the board is full
-    def __is_full_board(self):
-        for row in range(ROWS):
-            for col in range(COLS):
-                if self.tiles[row][col] == 0: return False
+        super().slide_tiles(direction)
+        if self.generate: self.moves += 1
+
+    # After a move: a new tile if the board changed, only then the game can be over.
+    # The tile after move n comes from the stream (seed, n) and not from the
+    # one the start tiles came from, so it doesn't depend on the moves undone
+    # before: playing an undone move again spawns the same tile, and the seed
+    # still replays the game.
+    def end_move(self):
+        if not self.generate: return
+        self.rng = RngStream(self.seed, self.history.cursor + 1)
+        self.generate_tiles()
+        self.generate = False
+        self.save_history()
+        if self.is_game_over():
+            self.gui.menu.active = True
+            self.finish_game()
+
+    # A random empty cell, counted in board order: the order of the index's
+    # list depends on the moves that led to the board (an undo rewrites it),
+    # so the same stream and board always give the same cell
+    def random_empty_cell(self):
+        k = self.rng.randrange(0, len(self.index.empty))
+        for cell, value in enumerate(self.index.values):
+            if value: continue
+            if k == 0: return cell
+            k -= 1
+
+    # Play a whole move, like an arrow key does
+    def play_move(self, direction):
+        self.slide_tiles(direction)
+        self.score_manager.check_highscore()
+        self.end_move()
+
+    # Record the current game in the stats (a game without moves isn't kept)
+    def finish_game(self):
+        if self.moves:
+            self.score_manager.record_game(int(self.tiles.max()), self.moves, time.monotonic() - self.started, self.seed)
+        self.moves = 0
+        self.started = time.monotonic()
+
+    # Start the undo history from the current board
+    def reset_history(self):
+        self.history.reset(pack_cells(self.tiles))
+        self.history_score = self.score
+
+    # Add the board after a move and its new tile to the undo history
+    def save_history(self):
+        self.history.push(pack_cells(self.tiles), self.score - self.history_score)
+        self.history_score = self.score
+
+    # Put a board from the history back, only the cells that differ are written
+    def __restore(self, board):
+        mask = (1 << CELL_BITS) - 1
+        values = self.index.values
+        changes = []
+        for cell in range(self.rows * self.cols):
+            exp = (board >> (CELL_BITS * cell)) & mask
+            value = 1 << exp if exp else 0
+            if values[cell] != value: changes.append( (cell, value) )
+        self.set_cells(changes)
+        # A recording can't go back, it goes on with a new game from this board
+        if self.recorder is not None: self.start_recording(self.recorder)
+
+    # Take back the last move, returns True if there was one
+    def undo(self):
+        step = self.history.undo()
+        if step is None: return False
+        board, delta = step
+        self.__restore(board)
+        self.score -= delta
+        self.history_score = self.score
+        # Every history entry is one counted move, an undone move isn't in the stats
+        self.moves -= 1
         return True
-    
-    # Check if no more moves are available
-    def __no_more_moves(self):
-        # UP
-        for row in range(1, ROWS):
-            for col in range(COLS):
-                if self.tiles[row][col] == self.tiles[row-1][col]: return False
-
-        # DOWN
-        for row in range(ROWS-2, -1, -1):
-            for col in range(COLS):
-                if self.tiles[row][col] == self.tiles[row+1][col]: return False
-
-        # RIIGHT
-        for row in range(ROWS):
-            for col in range(COLS-2, -1, -1):
-                if self.tiles[row][col] == self.tiles[row][col+1]: return False
-
-        # LEFT
-        for row in range(ROWS):
-            for col in range(1, COLS):
-                if self.tiles[row][col] == self.tiles[row][col-1]: return False
-        
+
+    # Play an undone move again, returns True if there was one
+    def redo(self):
+        step = self.history.redo()
+        if step is None: return False
+        board, delta = step
+        self.__restore(board)
+        self.score += delta
+        self.history_score = self.score
+        self.moves += 1
         return True
 
-    # Check if the game is over
-    def is_game_over(self):
-        if self.__is_full_board():
-            return self.__no_more_moves()
-        
     # Start a new game
     def new(self):
-        self.tiles = np.zeros( (ROWS, COLS) )
+        self.finish_game()
+        self.clear_board()
+        self.reseed()
         self.score_manager.newGame_score()
         self.generate_tiles()
+        self.reset_history()
+        if self.recorder is not None: self.start_recording(self.recorder)
         
     # Reset the game 
     def rst(self):
-        self.tiles = np.zeros( (ROWS, COLS) )
+        self.finish_game()
+        self.clear_board()
+        self.reseed()
         self.score_manager.reset_score()
         self.generate_tiles()
-
-def main():
+        self.reset_history()
+        if self.recorder is not None: self.start_recording(self.recorder)
+
+# Command line options of the game
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Python 2048 game")
+    parser.add_argument("--engine", choices=ENGINES, default="line", help="move engine used by the game")
+    parser.add_argument("--size", type=int, default=ROWS, choices=range(2, MAX_SIZE + 1), metavar="N", help=f"play on a N x N board (2 to {MAX_SIZE})")
+    parser.add_argument("--fps", type=int, default=FPS, help="frame rate limit while something is animating")
+    parser.add_argument("--autoplay-delay", type=float, default=AUTOPLAY_DELAY, metavar="SECONDS", help="time between two autoplay moves")
+    parser.add_argument("--undo-depth", type=int, default=DEPTH, metavar="N", help="moves that can be undone")
+    parser.add_argument("--record", metavar="PATH", help="append the played games to a binary recording file")
+    parser.add_argument("--frame-stats", action="store_true", help="print frame time and CPU use per frame on exit")
+    parser.add_argument("--instrument", action="store_true", help="count and time the hot paths (F3 shows them)")
+    parser.add_argument("--instrument-export", metavar="PATH", help="write the instrumentation stats to a JSON file periodically")
+    parser.add_argument("--instrument-interval", type=float, default=EXPORT_INTERVAL, help="seconds between two exports")
+    parser.add_argument("--profile", metavar="PATH", help="run the session under cProfile and write the stats on exit")
+    parser.add_argument("--startup-time", action="store_true", help="print the time to the first frame and quit")
+    args = parser.parse_args(argv)
+    if args.engine == "bitboard" and args.size != ROWS:
+        parser.error(f"the bitboard engine only plays {ROWS}x{ROWS} boards")
+    if args.record and args.size != ROWS:
+        parser.error(f"recordings only hold {ROWS}x{ROWS} boards")
+    return args
+
+# Time the hot paths of the game
+def instrument_hot_paths():
+    INSTRUMENTS.wrap(Game, 'slide_tiles')
+    INSTRUMENTS.wrap(Game, 'generate_tiles')
+    INSTRUMENTS.wrap(Game, 'is_game_over')
+    INSTRUMENTS.wrap(Game, 'draw_board')
+    INSTRUMENTS.wrap(GUI, 'update_scores')
+    INSTRUMENTS.wrap(Menu, 'show')
+    INSTRUMENTS.wrap(Assistant, 'update')
+    INSTRUMENTS.wrap(StatsStore, 'write_batch')
+    INSTRUMENTS.wrap(pygame.display, 'update', 'display.update')
+
+def main(argv=None):
+    args = parse_args(argv)
+    with profile_session(args.profile):
+        play(args)
+
+def play(args):
+
+    # Opt-in instrumentation
+    if args.instrument or args.instrument_export:
+        INSTRUMENTS.enable(args.instrument_export, args.instrument_interval)
+        instrument_hot_paths()
 
     # Initialize Pygame
     pygame.init()
@@ -479,19 +873,40 @@ def main():
     pygame.display.set_caption('2048')
     pygame.display.set_icon(pygame.image.load("images/2048_logo.png"))
     screen.fill( SCREEN_COLOR )
+    # Mouse motion doesn't change anything, don't wake up for it
+    pygame.event.set_blocked(pygame.MOUSEMOTION)
 
     # Initialize the Game object
-    game = Game(screen)
+    game = Game(screen, args.engine, args.size, undo_depth=args.undo_depth)
 
     # Initial GUI setup - GUI initial call
     game.gui.show_start()
 
     # Initial tiles displayed
     for i in range(2): game.generate_tiles(True)
+    game.reset_history()
+
+    # Record the games if asked
+    if args.record: game.start_recording(recording.Recorder.open(args.record))
+
+    # Waits for input and paces the frames, waking up to export the instrumentation stats
+    timeout = args.instrument_interval if INSTRUMENTS.enabled else None
+    scheduler = FrameScheduler(args.fps, timeout)
+    overlay = InstrumentOverlay(screen, game.gui.fonts)
+
+    # Hints and autoplay, a finished search wakes the loop up with a HINT_READY event
+    HINT_READY = pygame.event.custom_type()
+    assistant = Assistant(game, HintOverlay(screen, game.gui.fonts), args.autoplay_delay,
+                          notify=lambda: pygame.event.post(pygame.event.Event(HINT_READY)))
 
     # Main game loop
     while game.playing:
 
+        # Finished searches, autoplay move and hint
+        assistant.update(game.gui.dirty)
+        # The loop keeps running between two autoplay moves
+        scheduler.animating = assistant.autoplay
+
         # Update & draw the game board
         game.draw_board()
 
@@ -501,63 +916,99 @@ def main():
         # Update the scores in the GUI
         game.gui.update_scores(game.score_manager.score, game.score_manager.best ,game.score_manager.played_round)
 
-        # Event handling
-        for event in pygame.event.get():
-
-            # Handle quit event
-            if event.type == pygame.QUIT:
-                game.score_manager.played_round_updater()
-                sys.exit()
-
-            # Handle keydown events
-            if event.type == pygame.KEYDOWN:
+        # Instrumentation overlay
+        overlay.draw(game.gui.dirty)
+
+        # Update the changed parts of the display
+        game.gui.dirty.flush()
+        scheduler.end_frame()
+        if args.startup_time:
+            print(f"First frame after {1000 * (time.perf_counter() - START_TIME):.1f} ms")
+            return
+
+        # Event handling, blocks until something happens when nothing is animating
+        events = scheduler.events()
+        with INSTRUMENTS.section('main.events'):
+            for event in events:
+
+                # Handle quit event
+                if event.type == pygame.QUIT:
+                    game.finish_game()
+                    game.score_manager.played_round_updater()
+                    if game.recorder is not None: game.recorder.close()
+                    assistant.close()
+                    if args.frame_stats: print(scheduler.report())
+                    if INSTRUMENTS.enabled:
+                        INSTRUMENTS.export()
+                        print("\n".join(INSTRUMENTS.summary()))
+                    sys.exit()
+
+                # The window was uncovered, send the whole screen again
+                if event.type == pygame.WINDOWEXPOSED:
+                    game.gui.dirty.add( (0, 0, WIDTH, HEIGHT) )
+                # Handle keydown events
+                if event.type == pygame.KEYDOWN:
+
+                    # Show or hide the instrumentation overlay
+                    if event.key == pygame.K_F3 and INSTRUMENTS.enabled:
+                        overlay.toggle(game.gui.dirty)
                 
-                #Slide tiles UP
-                if event.key == pygame.K_UP:
-                    game.slide_tiles('UP')
-                    game.score_manager.check_highscore()
+                    # Undo (Ctrl+Z) and redo (Ctrl+Y or Ctrl+Shift+Z), not once the game is over
+                    if event.mod & pygame.KMOD_CTRL and not game.gui.menu.visible():
+                        if event.key == pygame.K_z and not event.mod & pygame.KMOD_SHIFT:
+                            game.undo()
+                        elif event.key in (pygame.K_y, pygame.K_z):
+                            game.redo()
+
+                    #Slide tiles UP
+                    if event.key == pygame.K_UP:
+                        game.slide_tiles('UP')
+                        game.score_manager.check_highscore()
                     
                 
-                #Slide tiles DOWN
-                if event.key == pygame.K_DOWN:
-                    game.slide_tiles('DOWN')
-                    game.score_manager.check_highscore()
-
-                #Slide tiles RIGHT
-                if event.key == pygame.K_RIGHT:
-                    game.slide_tiles('RIGHT')
-                    game.score_manager.check_highscore()
-
-                #Slide tiles LEFT
-                if event.key == pygame.K_LEFT:
-                    game.slide_tiles('LEFT')
-                    game.score_manager.check_highscore()
-
-                # Generate new tiles if a move was made
-                if game.generate:
-                    game.generate_tiles()
-                    game.generate = False
+                    #Slide tiles DOWN
+                    if event.key == pygame.K_DOWN:
+                        game.slide_tiles('DOWN')
+                        game.score_manager.check_highscore()
+
+                    #Slide tiles RIGHT
+                    if event.key == pygame.K_RIGHT:
+                        game.slide_tiles('RIGHT')
+                        game.score_manager.check_highscore()
+
+                    #Slide tiles LEFT
+                    if event.key == pygame.K_LEFT:
+                        game.slide_tiles('LEFT')
+                        game.score_manager.check_highscore()
+
+                    # Generate new tiles if a move was made, only then the game can be over
+                    game.end_move()
+
+                    # Hint for the current board, and autoplay on or off
+                    if event.key == pygame.K_h:
+                        assistant.hint()
+                    if event.key == pygame.K_a:
+                        assistant.toggle_autoplay()
             
-            # Handle mouse button events
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                if event.button == 1: 
-                 if game.gui.newGame_btn.collidepoint(event.pos) or game.gui.menu.tryAgain_btn.collidepoint(event.pos): 
-                    if game.gui.action_listener(event):
-                      game.new()
-                 elif game.gui.reset_btn.collidepoint(event.pos):
-                    if game.gui.action_listener(event):
-                       game.rst() 
-                       print("btn")
+                # Handle mouse button events
+                if event.type == pygame.MOUSEBUTTONDOWN:
+                    if event.button == 1: 
+                     if game.gui.newGame_btn.collidepoint(event.pos) or game.gui.menu.tryAgain_btn.collidepoint(event.pos): 
+                        if game.gui.action_listener(event):
+                          game.new()
+                     elif game.gui.reset_btn.collidepoint(event.pos):
+                        if game.gui.action_listener(event):
+                           game.rst() 
+                           print("btn")
+                     elif game.gui.undo_btn.collidepoint(event.pos):
+                        if not game.gui.menu.visible(): game.undo()
+                     elif game.gui.redo_btn.collidepoint(event.pos):
+                        if not game.gui.menu.visible(): game.redo()
 
-            
-        # Check if the game is over
-        if game.is_game_over():
-            game.gui.menu.active = True
-            
         # game.score_manager.check_highscore()
 
-        # Update the display
-        pygame.display.update()
+        # Write the instrumentation stats if the export interval has passed
+        INSTRUMENTS.maybe_export()
 
 # Start the main function
 if __name__ == "__main__":
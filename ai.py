@@ -0,0 +1,202 @@
+import time
+from collections import OrderedDict
+import bitboard
+
+# Expectimax AI player working on packed bitboards. Player nodes take the best
+# of the four moves, chance nodes average over every empty cell receiving a
+# 2 (70%) or a 4 (30%), like Game.generate_tiles.
+SPAWNS = ((1, 0.7), (2, 0.3))
+
+# Chance branches less likely than this are evaluated with the heuristic
+PROB_THRESHOLD = 0.0001
+
+# Heuristic weights for a single row (see _row_heuristic)
+LOST_PENALTY = 200000.0
+EMPTY_WEIGHT = 270.0
+MERGES_WEIGHT = 700.0
+MONOTONICITY_POWER, MONOTONICITY_WEIGHT = 4.0, 47.0
+SUM_POWER, SUM_WEIGHT = 3.5, 11.0
+
+# Score of one packed row: rewards empty cells, equal neighbours and rows
+# that keep increasing or decreasing, punishes big scattered tiles. The value
+# doesn't change when the row is reversed, so all 8 board symmetries score the same.
+def _row_heuristic(row):
+    line = [(row >> shift) & 0xF for shift in (0, 4, 8, 12)]
+    total = 0.0
+    empty = 0
+    merges = 0
+    prev = 0
+    counter = 0
+    for exp in line:
+        total += exp ** SUM_POWER
+        if exp == 0:
+            empty += 1
+        else:
+            if prev == exp:
+                counter += 1
+            elif counter > 0:
+                merges += 1 + counter
+                counter = 0
+            prev = exp
+    if counter > 0: merges += 1 + counter
+
+    mono_left = mono_right = 0.0
+    for i in range(1, 4):
+        if line[i - 1] > line[i]:
+            mono_left += line[i - 1] ** MONOTONICITY_POWER - line[i] ** MONOTONICITY_POWER
+        else:
+            mono_right += line[i] ** MONOTONICITY_POWER - line[i - 1] ** MONOTONICITY_POWER
+
+    return (LOST_PENALTY + EMPTY_WEIGHT * empty + MERGES_WEIGHT * merges
+            - MONOTONICITY_WEIGHT * min(mono_left, mono_right) - SUM_WEIGHT * total)
+
+# Heuristic of every packed row. Built on first use (it takes a good part of
+# a second), so importing the module stays cheap; the hint worker builds it on
+# its own thread.
+ROW_HEURISTIC = None
+
+def row_heuristics():
+    global ROW_HEURISTIC
+    if ROW_HEURISTIC is None:
+        ROW_HEURISTIC = [_row_heuristic(row) for row in range(65536)]
+    return ROW_HEURISTIC
+
+# Heuristic value of a whole board: every row plus every column
+def evaluate(board):
+    t = bitboard.transpose(board)
+    h = ROW_HEURISTIC or row_heuristics()
+    return (h[board & 0xFFFF] + h[(board >> 16) & 0xFFFF] + h[(board >> 32) & 0xFFFF] + h[board >> 48]
+            + h[t & 0xFFFF] + h[(t >> 16) & 0xFFFF] + h[(t >> 32) & 0xFFFF] + h[t >> 48])
+
+# Mirror every row (left <-> right)
+def flip_horizontal(board):
+    board = ((board & 0xF0F0F0F0F0F0F0F0) >> 4) | ((board & 0x0F0F0F0F0F0F0F0F) << 4)
+    return ((board & 0xFF00FF00FF00FF00) >> 8) | ((board & 0x00FF00FF00FF00FF) << 8)
+
+# Mirror the row order (top <-> bottom)
+def flip_vertical(board):
+    board = ((board & 0xFFFF0000FFFF0000) >> 16) | ((board & 0x0000FFFF0000FFFF) << 16)
+    return (board >> 32) | ((board & 0xFFFFFFFF) << 32)
+
+# Smallest of the 8 rotations/reflections of the board. Boards that are the
+# same up to a symmetry have the same canonical form and share a cache entry.
+def canonical(board):
+    h = flip_horizontal(board)
+    v = flip_vertical(board)
+    hv = flip_vertical(h)
+    t = bitboard.transpose(board)
+    th = flip_horizontal(t)
+    tv = flip_vertical(t)
+    thv = flip_vertical(th)
+    return min(board, h, v, hv, t, th, tv, thv)
+
+class SearchTimeout(Exception):
+    pass
+
+# Raised out of a search when its should_stop callback returns True
+class SearchCancelled(Exception):
+    pass
+
+class ExpectimaxPlayer:
+
+    # depth is the number of moves looked ahead. With a time_limit (seconds)
+    # the search deepens one move at a time until the deadline instead.
+    # cache_size bounds the number of cached positions (least recently used go first).
+    # should_stop is called now and then during a search, from the searching
+    # thread; when it returns True the search raises SearchCancelled.
+    def __init__(self, depth=3, cache_size=200000, time_limit=None, max_depth=8, should_stop=None):
+        self.depth = depth
+        self.cache_size = cache_size
+        self.time_limit = time_limit
+        self.max_depth = max_depth
+        self.should_stop = should_stop
+        self.cache = OrderedDict()
+        self.deadline = None
+        self.nodes = 0
+        # Depth reached by the last decision
+        self.last_depth = 0
+
+    # Best direction for a board in the same form as Game.tiles, None if no move is left
+    def best_move(self, tiles):
+        return self.best_move_board(bitboard.pack(tiles))
+
+    # Best direction for a packed bitboard
+    def best_move_board(self, board):
+        if self.time_limit is None:
+            self.deadline = None
+            self.last_depth = self.depth
+            return self._search_root(board, self.depth)[0]
+
+        # Iterative deepening: keep the answer of the deepest finished search
+        self.deadline = time.perf_counter() + self.time_limit
+        best = None
+        self.last_depth = 0
+        for depth in range(1, self.max_depth + 1):
+            try:
+                direction, _ = self._search_root(board, depth)
+            except SearchTimeout:
+                break
+            best = direction
+            self.last_depth = depth
+            if direction is None: break
+        if best is None:
+            # Not even depth 1 finished, fall back to the first legal move
+            for direction in bitboard.DIRECTIONS:
+                if bitboard.move(board, direction)[2]: return direction
+        return best
+
+    # Forget every cached position
+    def clear_cache(self):
+        self.cache.clear()
+
+    def _search_root(self, board, depth):
+        best_direction, best_value = None, -1.0
+        for direction in bitboard.DIRECTIONS:
+            new, _, moved = bitboard.move(board, direction)
+            if not moved: continue
+            value = self._chance_node(new, depth - 1, 1.0)
+            if value > best_value:
+                best_direction, best_value = direction, value
+        return best_direction, best_value
+
+    def _move_node(self, board, depth, prob):
+        best = 0.0
+        for direction in bitboard.DIRECTIONS:
+            new, _, moved = bitboard.move(board, direction)
+            if moved:
+                best = max(best, self._chance_node(new, depth, prob))
+        return best
+
+    def _chance_node(self, board, depth, prob):
+        if depth <= 0 or prob < PROB_THRESHOLD:
+            return evaluate(board)
+
+        self.nodes += 1
+        if self.nodes & 0xFF == 0:
+            if self.should_stop is not None and self.should_stop():
+                raise SearchCancelled()
+            if self.deadline is not None and time.perf_counter() > self.deadline:
+                raise SearchTimeout()
+
+        key = canonical(board)
+        entry = self.cache.get(key)
+        if entry is not None and entry[0] >= depth:
+            self.cache.move_to_end(key)
+            return entry[1]
+
+        empty_shifts = [shift for shift in range(0, 64, 4) if (board >> shift) & 0xF == 0]
+        if not empty_shifts:
+            return evaluate(board)
+
+        total = 0.0
+        cell_prob = prob / len(empty_shifts)
+        for shift in empty_shifts:
+            for exp, p in SPAWNS:
+                total += p * self._move_node(board | (exp << shift), depth - 1, cell_prob * p)
+        value = total / len(empty_shifts)
+
+        self.cache[key] = (depth, value)
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return value
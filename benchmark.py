@@ -0,0 +1,252 @@
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import bitboard
+from core import GameCore, DIRECTIONS, ENGINES
+
+# Benchmark suite for the engine, tile spawning, the game over check, frame
+# rendering and the startup time. Results are written as JSON and can be compared with a saved
+# baseline; a benchmark slower than the baseline by more than the threshold
+# is reported as a regression and makes the script exit with status 1.
+#
+#   python benchmark.py --output bench.json
+#   python benchmark.py --baseline bench.json --threshold 0.1
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Time func(arg) for every arg, best of repeat runs. Returns calls per second.
+# reset(arg), if given, runs before every call and isn't timed; the calls are
+# then timed one by one.
+def measure(func, args, repeat=5, min_time=0.2, reset=None):
+    best = float("inf")
+    for _ in range(repeat):
+        loops = 0
+        start = time.perf_counter()
+        timed = 0.0
+        while True:
+            if reset is None:
+                for arg in args: func(arg)
+            else:
+                for arg in args:
+                    reset(arg)
+                    call_start = time.perf_counter()
+                    func(arg)
+                    timed += time.perf_counter() - call_start
+            loops += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time / repeat: break
+        if reset is not None: elapsed = timed
+        best = min(best, elapsed / (loops * len(args)))
+    return 1.0 / best
+
+# Boards seen while playing random games, the realistic input of the benchmarks
+def sample_boards(count, seed=0):
+    rng = random.Random(seed)
+    boards = []
+    while len(boards) < count:
+        game = GameCore('bitboard', seed=rng.getrandbits(32))
+        for i in range(2): game.generate_tiles(True)
+        while not game.is_game_over() and len(boards) < count:
+            boards.append(game.tiles.copy())
+            game.slide_tiles(rng.choice(DIRECTIONS))
+            if game.generate:
+                game.generate_tiles()
+                game.generate = False
+    return boards
+
+# Play one random game to the end, returns the number of moves
+def random_game(game, rng):
+    game.clear_board()
+    for i in range(2): game.generate_tiles(True)
+    moves = 0
+    while not game.is_game_over():
+        game.slide_tiles(rng.choice(DIRECTIONS))
+        moves += 1
+        if game.generate:
+            game.generate_tiles()
+            game.generate = False
+    return moves
+
+def bench_engine(results, boards, repeat):
+    for engine in ENGINES:
+        # Every board is put back (and indexed again) before the timed slide
+        games = list(zip(games_for(boards, engine), boards))
+        def reset(item):
+            game, tiles = item
+            game.tiles = tiles.copy()
+        for direction in DIRECTIONS:
+            results[f"slide_tiles[{engine},{direction}]"] = measure(lambda item: item[0].slide_tiles(direction),
+                                                                    games, repeat, reset=reset)
+
+        game = GameCore(engine, seed=0)
+
+        rng = random.Random(0)
+        results[f"random_game[{engine}]"] = measure(lambda _: random_game(game, rng), [None], repeat, min_time=1.0)
+
+    packed = [bitboard.pack(tiles) for tiles in boards]
+    for direction in DIRECTIONS:
+        results[f"bitboard.move[{direction}]"] = measure(lambda board: bitboard.move(board, direction), packed, repeat)
+
+# One game per board, so that the measured calls don't include indexing a new board
+def games_for(boards, engine='line'):
+    games = []
+    for tiles in boards:
+        game = GameCore(engine, seed=0)
+        game.tiles = tiles.copy()
+        games.append(game)
+    return games
+
+def bench_spawn(results, boards, repeat):
+    def spawn(game):
+        row, col, _ = game.generate_tiles()
+        game.set_tile(row, col, 0)
+    results["generate_tiles"] = measure(spawn, games_for([tiles for tiles in boards if (tiles == 0).any()]), repeat)
+
+def bench_game_over(results, boards, repeat):
+    game_over = GameCore.is_game_over
+    full = games_for([tiles for tiles in boards if not (tiles == 0).any()])
+    not_full = games_for([tiles for tiles in boards if (tiles == 0).any()])
+    if full: results["is_game_over[full]"] = measure(game_over, full, repeat)
+    results["is_game_over[not_full]"] = measure(game_over, not_full, repeat)
+
+# draw_board and update_scores on an offscreen surface (SDL dummy video driver)
+def bench_render(results, boards, repeat):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    import pygame
+
+    # 2048.py can't be imported by name, load it from its path
+    spec = importlib.util.spec_from_file_location("game2048", os.path.join(HERE, "2048.py"))
+    game_module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(game_module)
+
+    pygame.init()
+    screen = pygame.display.set_mode( (game_module.WIDTH, game_module.HEIGHT) )
+    # Never write the real score database
+    scores_dir = tempfile.TemporaryDirectory()
+    score_manager = game_module.ScoreManager(os.path.join(scores_dir.name, "2048.db"), json_path=None)
+    game = game_module.Game(screen, score_manager=score_manager)
+    game.gui.show_start()
+    game.gui.menu.hide(game.gui.board_rect)
+
+    def frame(score):
+        game.draw_board()
+        game.gui.update_scores(score, score, 1)
+        game.gui.dirty.rects = []
+
+    # Every frame shows another board and score. The board is swapped without
+    # re-indexing it, only drawing is measured.
+    scores = list(range(len(boards)))
+    def changing_frame(i):
+        game._tiles = boards[i]
+        frame(scores[i])
+    results["frame[changed]"] = measure(changing_frame, range(len(boards)), repeat)
+
+    # Nothing changed since the last frame
+    frame(0)
+    results["frame[idle]"] = measure(lambda _: frame(0), [None], repeat)
+
+    # Everything drawn again
+    def full_frame(i):
+        game._tiles = boards[i]
+        game.drawn_tiles = None
+        game.gui.shown_scores = (None, None, None)
+        frame(scores[i])
+    results["frame[full]"] = measure(full_frame, range(len(boards)), repeat)
+    pygame.quit()
+    score_manager.stats.close()
+    scores_dir.cleanup()
+
+# Cold start of new processes, measured from outside: the game until its first
+# frame (--startup-time) with and without the font cache, and importing the
+# headless modules, which must not load pygame
+def bench_startup(results, boards, repeat):
+    env = dict(os.environ, SDL_VIDEODRIVER="dummy", SDL_AUDIODRIVER="dummy", PYTHONPATH=HERE)
+    run_dir = tempfile.TemporaryDirectory()
+    shutil.copytree(os.path.join(HERE, "images"), os.path.join(run_dir.name, "images"))
+    font_cache = os.path.join(run_dir.name, "2048-fonts.json")
+    game = [sys.executable, os.path.join(HERE, "2048.py"), "--startup-time"]
+
+    def first_frame(cold):
+        if cold and os.path.exists(font_cache): os.remove(font_cache)
+        subprocess.run(game, cwd=run_dir.name, env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    results["startup[first_frame,cold]"] = measure(first_frame, [True], repeat)
+    results["startup[first_frame,warm]"] = measure(first_frame, [False], repeat)
+
+    headless = "import sys, core, ai, env, montecarlo, ntuple, recording; assert 'pygame' not in sys.modules"
+    def import_headless(_):
+        subprocess.run([sys.executable, "-c", headless], cwd=run_dir.name, env=env, check=True)
+    results["startup[import_headless]"] = measure(import_headless, [None], repeat)
+    run_dir.cleanup()
+
+SUITES = {
+    "engine": bench_engine,
+    "spawn": bench_spawn,
+    "game_over": bench_game_over,
+    "render": bench_render,
+    "startup": bench_startup,
+}
+
+# Compare results with a baseline, returns the names of the regressions
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, ops in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:40} {ops:14.1f} ops/s   (new)")
+            continue
+        change = ops / base - 1
+        flag = ""
+        if change < -threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:40} {ops:14.1f} ops/s {change:+8.1%}{flag}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the 2048 engine and renderer")
+    parser.add_argument("--suite", action="append", choices=sorted(SUITES), help="suites to run (all by default)")
+    parser.add_argument("--boards", type=int, default=500, help="number of sample boards")
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions, the best one is kept")
+    parser.add_argument("--output", metavar="PATH", help="write the results as JSON")
+    parser.add_argument("--baseline", metavar="PATH", help="compare with results saved by --output")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown before a regression is flagged")
+    args = parser.parse_args(argv)
+
+    boards = sample_boards(args.boards)
+    results = {}
+    for name in args.suite or sorted(SUITES):
+        SUITES[name](results, boards, args.repeat)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "unit": "ops_per_sec",
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} regression(s) over {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+import tables
+
+# A 4x4 board packed into one 64-bit integer. Every cell holds the exponent
+# of its tile (0 = empty, 1 = 2, 2 = 4, ... 15 = 32768) in 4 bits, cell (row, col)
+# sitting at bits 4 * (4 * row + col). Row 0 is therefore the lowest 16 bits.
+ROWS, COLS = 4, 4
+ROW_MASK = 0xFFFF
+MAX_EXPONENT = 15
+
+DIRECTIONS = ('UP', 'DOWN', 'LEFT', 'RIGHT')
+
+# Slide one line towards index 0 with the same rules as Game.slide_tiles:
+# every tile travels over empty cells and merges with the first equal tile it
+# meets. A merged tile is not locked, so [2, 2, 4] becomes [8, 0, 0].
+# Works on exponents, returns the new line and the score gained.
+def slide_exponents(line):
+    result = []
+    score = 0
+    for exp in line:
+        if exp == 0: continue
+        # Exponent 15 can't grow inside 4 bits, so it never merges
+        if result and result[-1] == exp and exp < MAX_EXPONENT:
+            result[-1] += 1
+            score += 1 << result[-1]
+        else:
+            result.append(exp)
+    result += [0] * (len(line) - len(result))
+    return result, score
+
+# Spread the 4 nibbles of a row into one column (nibble i goes to row i)
+def _row_to_col(row):
+    return (row & 0xF) | ((row >> 4) & 0xF) << 16 | ((row >> 8) & 0xF) << 32 | ((row >> 12) & 0xF) << 48
+
+# Build the lookup tables for all 65536 possible rows. The move tables hold
+# the XOR between the old and the new row so a move is "board ^= table[row]".
+def _build_tables():
+    left, right, up, down = [0] * 65536, [0] * 65536, [0] * 65536, [0] * 65536
+    score_left, score_right = [0] * 65536, [0] * 65536
+
+    for row in range(65536):
+        line = [(row >> shift) & 0xF for shift in (0, 4, 8, 12)]
+
+        moved, score = slide_exponents(line)
+        result = moved[0] | moved[1] << 4 | moved[2] << 8 | moved[3] << 12
+        left[row] = row ^ result
+        up[row] = _row_to_col(row) ^ _row_to_col(result)
+        score_left[row] = score
+
+        moved, score = slide_exponents(line[::-1])
+        moved.reverse()
+        result = moved[0] | moved[1] << 4 | moved[2] << 8 | moved[3] << 12
+        right[row] = row ^ result
+        down[row] = _row_to_col(row) ^ _row_to_col(result)
+        score_right[row] = score
+
+    return left, right, up, down, score_left, score_right
+
+# The tables are built once and kept in a memory-mapped cache file (see
+# tables.py), rebuilt when slide_exponents gives other results
+ROW_LEFT, ROW_RIGHT, COL_UP, COL_DOWN, SCORE_LEFT, SCORE_RIGHT = tables.load(_build_tables, tables.rules_fingerprint(slide_exponents))
+
+# Swap rows and columns of a packed board
+def transpose(board):
+    a1 = board & 0xF0F00F0FF0F00F0F
+    a2 = board & 0x0000F0F00000F0F0
+    a3 = board & 0x0F0F00000F0F0000
+    a = a1 | (a2 << 12) | (a3 >> 12)
+    b1 = a & 0xFF00FF0000FF00FF
+    b2 = a & 0x00FF00FF00000000
+    b3 = a & 0x00000000FF00FF00
+    return b1 | (b2 >> 24) | (b3 << 24)
+
+# Pack a ROWS x COLS array of tile values (e.g. Game.tiles) into a bitboard
+def pack(tiles):
+    board = 0
+    shift = 0
+    for row in range(ROWS):
+        for col in range(COLS):
+            board |= (int(tiles[row][col]).bit_length() - 1 if tiles[row][col] else 0) << shift
+            shift += 4
+    return board
+
+# Unpack a bitboard into a list of rows holding tile values
+def unpack(board):
+    tiles = []
+    for row in range(ROWS):
+        line = []
+        for col in range(COLS):
+            exp = board & 0xF
+            line.append(1 << exp if exp else 0)
+            board >>= 4
+        tiles.append(line)
+    return tiles
+
+# Apply a move, returns (new board, score gained, whether anything changed)
+def move(board, direction):
+    score = 0
+    new = board
+    if direction == 'LEFT':
+        for shift in (0, 16, 32, 48):
+            row = (board >> shift) & ROW_MASK
+            new ^= ROW_LEFT[row] << shift
+            score += SCORE_LEFT[row]
+    elif direction == 'RIGHT':
+        for shift in (0, 16, 32, 48):
+            row = (board >> shift) & ROW_MASK
+            new ^= ROW_RIGHT[row] << shift
+            score += SCORE_RIGHT[row]
+    else:
+        t = transpose(board)
+        if direction == 'UP':
+            table, scores = COL_UP, SCORE_LEFT
+        else:
+            table, scores = COL_DOWN, SCORE_RIGHT
+        for col in range(COLS):
+            row = (t >> (16 * col)) & ROW_MASK
+            new ^= table[row] << (4 * col)
+            score += scores[row]
+    return new, score, new != board
+
+# Number of empty cells on the board
+def count_empty(board):
+    empty = 0
+    for _ in range(16):
+        if board & 0xF == 0: empty += 1
+        board >>= 4
+    return empty
+
+# Highest tile value on the board
+def max_tile(board):
+    best = 0
+    while board:
+        best = max(best, board & 0xF)
+        board >>= 4
+    return 1 << best if best else 0
+
+# The game is over when no direction changes the board
+def is_game_over(board):
+    for direction in DIRECTIONS:
+        if move(board, direction)[2]: return False
+    return True
+
+# Put a 2 (70%) or a 4 (30%) on a random empty cell, like Game.generate_tiles.
+# rng is any object with randrange/randint, e.g. a random.Random
+def spawn(board, rng, first=False):
+    empty = [shift for shift in range(0, 64, 4) if (board >> shift) & 0xF == 0]
+    if not empty: return board
+    shift = empty[rng.randrange(0, len(empty))]
+    exp = 1 if first or rng.randint(1, 10) <= 7 else 2
+    return board | exp << shift
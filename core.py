@@ -0,0 +1,425 @@
+import numpy as np
+from lazyimport import lazy_import
+from rng import RngStream
+
+# Building the bitboard tables takes a good part of the startup time, they
+# are only loaded once the bitboard engine or a BatchSimulator is used
+bitboard = lazy_import("bitboard")
+
+# Headless game rules: nothing in here touches pygame, so the module can be
+# imported on servers without a display.
+COLS, ROWS = 4, 4
+# Same order as bitboard.DIRECTIONS, action indices refer to it
+DIRECTIONS = ('UP', 'DOWN', 'LEFT', 'RIGHT')
+
+# largest board side supported
+MAX_SIZE = 16
+
+# move engines: 'line' slides every line in one pass and works on any board size,
+# 'array' is the reference cell by cell engine, 'bitboard' uses the lookup tables (4x4 only)
+ENGINES = ('line', 'array', 'bitboard')
+
+# Slide a line of tile values towards index 0 with the game rules: every tile
+# travels over empty cells and merges with the first equal tile it meets (a
+# merged tile isn't locked, so [2, 2, 4] becomes [8, 0, 0]). One pass, no
+# recursion. Returns the new line and the score gained.
+def slide_line(line):
+    result = []
+    score = 0
+    for value in line:
+        if value == 0: continue
+        if result and result[-1] == value:
+            result[-1] += value
+            score += result[-1]
+        else:
+            result.append(value)
+    result += [0] * (len(line) - len(result))
+    return result, score
+
+# Index of a board kept up to date as its cells change: the empty cells in a
+# list with O(1) random choice, insertion and removal, and the number of pairs
+# of equal neighbouring tiles. Together they make the game over check O(1).
+# Cells are flat indices, row * cols + col.
+class BoardIndex:
+
+    def __init__(self, tiles):
+        self.rows, self.cols = len(tiles), len(tiles[0])
+        cells = self.rows * self.cols
+        # Neighbours of every cell, each pair once (right and down)
+        self.pairs_of = [[] for _ in range(cells)]
+        for cell in range(cells):
+            if (cell + 1) % self.cols: self.__link(cell, cell + 1)
+            if cell + self.cols < cells: self.__link(cell, cell + self.cols)
+        self.rebuild(tiles)
+
+    def __link(self, a, b):
+        self.pairs_of[a].append( (a, b) )
+        self.pairs_of[b].append( (a, b) )
+
+    # Index a whole board from scratch
+    def rebuild(self, tiles):
+        self.values = [int(value) for row in tiles for value in row]
+        self.empty = []
+        self.position = [-1] * len(self.values)
+        for cell, value in enumerate(self.values):
+            if value == 0: self.__add_empty(cell)
+        self.equal_pairs = sum(1 for a, b in self.__all_pairs() if self.values[a] and self.values[a] == self.values[b])
+
+    def __all_pairs(self):
+        return {pair for pairs in self.pairs_of for pair in pairs}
+
+    def __add_empty(self, cell):
+        self.position[cell] = len(self.empty)
+        self.empty.append(cell)
+
+    # Swap the cell with the last empty cell and drop it
+    def __remove_empty(self, cell):
+        index = self.position[cell]
+        last = self.empty.pop()
+        if last != cell:
+            self.empty[index] = last
+            self.position[last] = index
+        self.position[cell] = -1
+
+    # Apply a list of (cell, new value) changes
+    def update(self, changes):
+        values = self.values
+        pairs = set()
+        for cell, _ in changes: pairs.update(self.pairs_of[cell])
+
+        for a, b in pairs:
+            if values[a] and values[a] == values[b]: self.equal_pairs -= 1
+        for cell, value in changes:
+            if values[cell] == 0 and value: self.__remove_empty(cell)
+            elif values[cell] and not value: self.__add_empty(cell)
+            values[cell] = value
+        for a, b in pairs:
+            if values[a] and values[a] == values[b]: self.equal_pairs += 1
+
+    # No empty cell and no equal neighbours left
+    def is_game_over(self):
+        return not self.empty and self.equal_pairs == 0
+
+# Holds one board and applies the game rules to it
+class GameCore:
+
+    def __init__(self, engine='line', seed=None, rows=ROWS, cols=COLS):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine {engine!r}, expected one of {ENGINES}")
+        if not (2 <= rows <= MAX_SIZE and 2 <= cols <= MAX_SIZE):
+            raise ValueError(f"Board size {rows}x{cols} out of range 2..{MAX_SIZE}")
+        if engine == 'bitboard' and (rows, cols) != (ROWS, COLS):
+            raise ValueError(f"The bitboard engine only plays {ROWS}x{COLS} boards")
+        self.rows, self.cols = rows, cols
+        # Cells of every line, starting from the edge the tiles slide to
+        self.lines = {
+            'UP': [[row * cols + col for row in range(rows)] for col in range(cols)],
+            'DOWN': [[row * cols + col for row in reversed(range(rows))] for col in range(cols)],
+            'LEFT': [[row * cols + col for col in range(cols)] for row in range(rows)],
+            'RIGHT': [[row * cols + col for col in reversed(range(cols))] for row in range(rows)],
+        }
+        # Move engine used by slide_tiles
+        self.engine = engine
+        # The bitboard engine keeps the board packed too (see set_cells), so a
+        # move doesn't pack it again; None with the other engines
+        self.packed = None
+        # Random stream used to spawn tiles
+        self.reseed(seed)
+        # recording.Recorder receiving the moves and spawns, if any
+        self.recorder = None
+        # Initialize the game tiles with zeros (also builds the board index)
+        self.tiles = np.zeros( (rows, cols), dtype=np.int64 )
+        self.score = 0
+        # Flag of generating new tile
+        self.generate = False
+        # Cells touched by the current move
+        self.changed_cells = set()
+
+    # The board; assigning a new one re-indexes it. Cells changed in place
+    # have to go through set_tile or set_cells to keep the index right.
+    @property
+    def tiles(self):
+        return self._tiles
+
+    @tiles.setter
+    def tiles(self, tiles):
+        self._tiles = tiles
+        self.index = BoardIndex(tiles)
+        if self.engine == 'bitboard': self.packed = bitboard.pack(tiles)
+
+    # Change one cell
+    def set_tile(self, row, col, value):
+        self.set_cells([ (row * self.cols + col, int(value)) ])
+
+    # Change some cells, a list of (cell, value) in cell order
+    def set_cells(self, changes):
+        tiles, cols = self._tiles, self.cols
+        for cell, value in changes:
+            tiles[cell // cols, cell % cols] = value
+        self.index.update(changes)
+        if self.packed is not None:
+            for cell, value in changes:
+                self.packed = self.packed & ~(0xF << 4 * cell) | (value.bit_length() - 1 if value else 0) << 4 * cell
+
+    # Empty the board
+    def clear_board(self):
+        self.tiles = np.zeros( (self.rows, self.cols), dtype=np.int64 )
+
+    # Generate a new tile in a random empty position, returns (row, col, value)
+    def generate_tiles(self, first=False):
+        row, col = divmod(self.random_empty_cell(), self.cols)
+        ranndom_num = self.rng.randint(1, 10)
+        tile_value = 2 if first or ranndom_num <= 7 else 4
+        self.set_tile(row, col, tile_value)
+        if self.recorder is not None: self.recorder.spawn(row * self.cols + col, tile_value.bit_length() - 1)
+        return row, col, tile_value
+
+    # A random empty cell, picked in O(1) from the index's list of empty cells
+    def random_empty_cell(self):
+        empty_tiles = self.index.empty
+        return empty_tiles[self.rng.randrange(0, len(empty_tiles))]
+
+    # Spawn the next tiles from a new random stream, seed None picks a new
+    # root seed. self.seed is kept so the game can be played again.
+    def reseed(self, seed=None):
+        self.rng = RngStream(seed)
+        self.seed = self.rng.seed_value
+
+    # Record the game from the current board on with a recording.Recorder
+    def start_recording(self, recorder):
+        if (self.rows, self.cols) != (ROWS, COLS):
+            raise ValueError(f"Recordings only hold {ROWS}x{COLS} boards")
+        self.recorder = recorder
+        recorder.begin_game(self.seed, bitboard.pack(self.tiles))
+
+    # Move and merge tiles based on the direction
+    def __move_and_merge(self, direction, row, col):
+        dx, dy = 0, 0
+        if direction == 'UP': dy = -1
+        elif direction == 'DOWN': dy = 1
+        elif direction == 'RIGHT': dx = 1
+        elif direction == 'LEFT': dx = -1
+
+        # Stop at the edge (a negative index would wrap around to the other side)
+        if not (0 <= row + dy < self.rows and 0 <= col + dx < self.cols): return
+
+        self.changed_cells.add(row * self.cols + col)
+        self.changed_cells.add((row + dy) * self.cols + col + dx)
+
+        # Move tiles
+        if self.tiles[row + dy][col + dx] == 0:
+            value = self.tiles[row][col]
+            self.tiles[row][col] = 0
+            self.tiles[row + dy][col + dx] = value
+            self.generate = True
+            self.__move_and_merge(direction, row + dy, col + dx)
+        # Merge tiles
+        elif self.tiles[row][col] == self.tiles[row + dy][col + dx]:
+            self.tiles[row][col] = 0
+            self.tiles[row + dy][col + dx] *= 2
+            self.score += int(self.tiles[row + dy][col + dx])
+            self.generate = True
+
+    # Slide every line in one pass
+    def __slide_lines(self, direction):
+        values = self.index.values
+        cols = self.cols
+        for line in self.lines[direction]:
+            old = [values[cell] for cell in line]
+            new, score = slide_line(old)
+            if new == old: continue
+            for cell, before, after in zip(line, old, new):
+                if before != after:
+                    self._tiles[cell // cols][cell % cols] = after
+                    self.changed_cells.add(cell)
+            self.score += score
+            self.generate = True
+
+    # Slide tiles with the table driven bitboard engine, on the packed board.
+    # Only the cells whose nibble changed are written back to the tiles and
+    # the index, lowest cell first.
+    def __slide_bitboard(self, direction):
+        old = self.packed
+        board, score, moved = bitboard.move(old, direction)
+        if not moved: return
+        self.packed = board
+        tiles = self._tiles
+        changes = []
+        diff = old ^ board
+        while diff:
+            cell = ((diff & -diff).bit_length() - 1) >> 2
+            diff &= ~(0xF << 4 * cell)
+            exp = (board >> 4 * cell) & 0xF
+            value = 1 << exp if exp else 0
+            tiles[cell >> 2, cell & 3] = value
+            changes.append( (cell, value) )
+        self.index.update(changes)
+        self.score += score
+        self.generate = True
+
+    # Slide tiles based on the direction
+    def slide_tiles(self, direction):
+        # generate stays set until a tile is spawned, clear it to see if this move changed anything
+        pending = self.generate
+        self.generate = False
+        self.__slide(direction)
+        # Update the index with the touched cells, in cell order whatever the
+        # engine (the bitboard engine updates it itself)
+        if self.changed_cells:
+            cols = self.cols
+            self.index.update([ (cell, int(self._tiles[cell // cols][cell % cols])) for cell in sorted(self.changed_cells) ])
+            self.changed_cells.clear()
+        if self.recorder is not None: self.recorder.move(direction, self.generate)
+        self.generate = self.generate or pending
+
+    # Move every tile with the selected engine
+    def __slide(self, direction):
+
+        if self.engine == 'line':
+            self.__slide_lines(direction)
+            return
+
+        if self.engine == 'bitboard':
+            self.__slide_bitboard(direction)
+            return
+
+        if direction == 'UP':
+            for row in range(1, self.rows):
+                for col in range(self.cols):
+                    if self.tiles[row][col] != 0: self.__move_and_merge(direction, row, col)
+
+        if direction == 'DOWN':
+            for row in range(self.rows-2, -1, -1):
+                for col in range(self.cols):
+                    if self.tiles[row][col] != 0: self.__move_and_merge(direction, row, col)
+
+        if direction == 'RIGHT':
+            for row in range(self.rows):
+                for col in range(self.cols-2, -1, -1):
+                    if self.tiles[row][col] != 0: self.__move_and_merge(direction, row, col)
+
+        if direction == 'LEFT':
+            for row in range(self.rows):
+                for col in range(1, self.cols):
+                    if self.tiles[row][col] != 0: self.__move_and_merge(direction, row, col)
+
+    # Check if the game is over, O(1) thanks to the board index
+    def is_game_over(self):
+        return self.index.is_game_over()
+
+# Resulting row for every packed 16-bit row slid to the left, and the score it
+# gains. Built on first use, with the bitboard tables.
+_left_tables = None
+
+def left_tables():
+    global _left_tables
+    if _left_tables is None:
+        rows = np.arange(65536, dtype=np.uint16) ^ np.array(bitboard.ROW_LEFT, dtype=np.uint16)
+        _left_tables = (rows, np.array(bitboard.SCORE_LEFT, dtype=np.int64))
+    return _left_tables
+
+# Runs N games at once. The boards live in one (N, ROWS, COLS) array of tile
+# exponents (0 = empty, 1 = 2, 2 = 4, ...) and every step is a handful of
+# vectorized calls whatever N is.
+class BatchSimulator:
+
+    def __init__(self, n, seed=None):
+        self.n = n
+        self.left_rows, self.left_scores = left_tables()
+        self.rng = np.random.default_rng(seed)
+        self.boards = np.zeros( (n, ROWS, COLS), dtype=np.int8 )
+        self.scores = np.zeros(n, dtype=np.int64)
+        self.done = np.zeros(n, dtype=bool)
+        self.reset()
+
+    # Start new games on the boards selected by mask (all of them by default)
+    def reset(self, mask=None):
+        if mask is None: mask = np.ones(self.n, dtype=bool)
+        self.boards[mask] = 0
+        self.scores[mask] = 0
+        self.done[mask] = False
+        # The two first tiles are always 2's, like Game.generate_tiles(True)
+        for i in range(2): self.spawn(mask, first=True)
+
+    # Tile values of all boards, in the same form as Game.tiles
+    def tiles(self):
+        return np.where(self.boards > 0, np.left_shift(1, self.boards, dtype=np.int64), 0)
+
+    # Boards oriented so that the given direction slides towards column 0
+    @staticmethod
+    def _oriented(boards, direction):
+        if direction == 'LEFT': return boards
+        if direction == 'RIGHT': return boards[:, :, ::-1]
+        if direction == 'UP': return boards.transpose(0, 2, 1)
+        return boards.transpose(0, 2, 1)[:, :, ::-1]
+
+    # Pack every row of oriented boards into a 16-bit code
+    @staticmethod
+    def _row_codes(view):
+        rows = view.astype(np.int64)
+        return rows[..., 0] | rows[..., 1] << 4 | rows[..., 2] << 8 | rows[..., 3] << 12
+
+    # Slide the selected boards in one direction, returns (score gained, moved flags)
+    def _slide(self, index, direction):
+        boards = self.boards[index]
+        view = self._oriented(boards, direction)
+        codes = self._row_codes(view)
+        new_codes = self.left_rows[codes].astype(np.int64)
+        gained = self.left_scores[codes].sum(axis=1)
+        moved = (new_codes != codes).any(axis=1)
+        for col in range(COLS):
+            view[..., col] = (new_codes >> (4 * col)) & 0xF
+        self.boards[index] = boards
+        return gained, moved
+
+    # Put a tile on a random empty cell of every board selected by mask
+    def spawn(self, mask, first=False):
+        index = np.flatnonzero(mask)
+        if len(index) == 0: return
+        flat = self.boards[index].reshape(len(index), -1)
+        empty = flat == 0
+        has_empty = empty.any(axis=1)
+        # The empty cell with the highest random key is a uniform choice
+        keys = np.where(empty, self.rng.random(empty.shape), -1.0)
+        cells = keys.argmax(axis=1)
+        if first:
+            values = np.ones(len(index), dtype=np.int8)
+        else:
+            # 70% chance for a 2 and 30% for a 4
+            values = np.where(self.rng.integers(1, 11, len(index)) <= 7, 1, 2).astype(np.int8)
+        flat[has_empty, cells[has_empty]] = values[has_empty]
+        self.boards[index] = flat.reshape(-1, ROWS, COLS)
+
+    # Flag the games that have no move left
+    def check_done(self):
+        b = self.boards
+        empty = (b == 0).any(axis=(1, 2))
+        # Exponent 15 tiles can't merge inside a packed row
+        pairs_h = ((b[:, :, 1:] == b[:, :, :-1]) & (b[:, :, 1:] < bitboard.MAX_EXPONENT)).any(axis=(1, 2))
+        pairs_v = ((b[:, 1:, :] == b[:, :-1, :]) & (b[:, 1:, :] < bitboard.MAX_EXPONENT)).any(axis=(1, 2))
+        self.done[:] = ~(empty | pairs_h | pairs_v)
+        return self.done
+
+    # Directions that change each board, a (N, 4) bool array in DIRECTIONS order
+    def legal_moves(self, out=None):
+        if out is None: out = np.empty( (self.n, len(DIRECTIONS)), dtype=bool )
+        for d, direction in enumerate(DIRECTIONS):
+            codes = self._row_codes(self._oriented(self.boards, direction))
+            (self.left_rows[codes] != codes).any(axis=1, out=out[:, d])
+        return out
+
+    # Apply one move per board (indices into DIRECTIONS), spawn a tile on the
+    # boards that changed and flag finished games. Finished games are left alone.
+    # Returns the score gained and the moved flags of every board.
+    def step(self, moves):
+        moves = np.asarray(moves)
+        gained = np.zeros(self.n, dtype=np.int64)
+        moved = np.zeros(self.n, dtype=bool)
+        for d, direction in enumerate(DIRECTIONS):
+            index = np.flatnonzero((moves == d) & ~self.done)
+            if len(index) == 0: continue
+            gained[index], moved[index] = self._slide(index, direction)
+        self.scores += gained
+        self.spawn(moved)
+        self.check_done()
+        return gained, moved
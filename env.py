@@ -0,0 +1,127 @@
+import numpy as np
+import bitboard
+from core import BatchSimulator, DIRECTIONS, ROWS, COLS
+from rng import RngStream
+
+# Reinforcement learning environments over the game rules, without pygame.
+# Actions are indices into DIRECTIONS, the reward of a step is the score
+# gained by the move, like Game.slide_tiles adds to the score.
+#
+# Observations come in two forms:
+#   'exponents': (ROWS, COLS) int8 tile exponents (0 = empty, 1 = 2, 2 = 4, ...)
+#   'onehot':    (PLANES, ROWS, COLS) uint8 planes, plane k set where the exponent is k
+# The returned observation is a view of a buffer allocated once and
+# overwritten by the next step; copy it to keep it.
+OBSERVATIONS = ('exponents', 'onehot')
+PLANES = bitboard.MAX_EXPONENT + 1
+
+# Episode n of an environment draws its tiles from the stream
+# RngStream(seed, n) (or stream.split(n) for an RngStream given as the seed,
+# e.g. one split per worker), so any episode can be played again on its own.
+class Env2048:
+
+    def __init__(self, observation='exponents', seed=None):
+        if observation not in OBSERVATIONS:
+            raise ValueError(f"Unknown observation {observation!r}, expected one of {OBSERVATIONS}")
+        self.observation = observation
+        self.seed(seed)
+        self.board = 0
+        self.score = 0
+        self.done = False
+        self.exponents = np.zeros( (ROWS, COLS), dtype=np.int8 )
+        self.onehot = np.zeros( (PLANES, ROWS, COLS), dtype=np.uint8 )
+        self.mask = np.zeros(len(DIRECTIONS), dtype=bool)
+        self.planes = np.arange(PLANES, dtype=np.int8).reshape(PLANES, 1, 1)
+
+    # Root stream of the episodes (seed an int, an RngStream or None for a
+    # random one), the next episode is number 0
+    def seed(self, seed=None):
+        self.stream = seed if isinstance(seed, RngStream) else RngStream(seed)
+        self.episode = 0
+
+    # Start a new game, returns the first observation. A seed starts the episodes over from it.
+    def reset(self, seed=None):
+        if seed is not None: self.seed(seed)
+        self.rng = self.stream.split(self.episode)
+        self.episode += 1
+        # The two first tiles are always 2's, like Game.generate_tiles(True)
+        self.board = bitboard.spawn(bitboard.spawn(0, self.rng, first=True), self.rng, first=True)
+        self.score = 0
+        self.done = False
+        return self._observe()
+
+    # Play one move, returns (observation, reward, done, info). A move that
+    # changes nothing gives no reward and spawns no tile.
+    def step(self, action):
+        if self.done:
+            raise RuntimeError("step() called on a finished game, call reset()")
+        board, reward, moved = bitboard.move(self.board, DIRECTIONS[action])
+        if moved:
+            self.board = bitboard.spawn(board, self.rng)
+            self.score += reward
+            self.done = bitboard.is_game_over(self.board)
+        info = {"score": self.score, "moved": moved, "max_tile": bitboard.max_tile(self.board)}
+        return self._observe(), reward, self.done, info
+
+    # Legal directions as a bool array in DIRECTIONS order
+    def action_mask(self):
+        for d, direction in enumerate(DIRECTIONS):
+            self.mask[d] = bitboard.move(self.board, direction)[2]
+        return self.mask
+
+    def _observe(self):
+        board = self.board
+        flat = self.exponents.reshape(-1)
+        for cell in range(ROWS * COLS):
+            flat[cell] = board & 0xF
+            board >>= 4
+        if self.observation == 'exponents':
+            return self.exponents
+        np.equal(self.exponents, self.planes, out=self.onehot.view(bool))
+        return self.onehot
+
+# N environments stepped together on a BatchSimulator. Observations, rewards,
+# done flags and action masks are written into buffers allocated once; games
+# that end are reset right away and their final score is reported in info.
+class VectorEnv:
+
+    def __init__(self, n, observation='exponents', seed=None):
+        if observation not in OBSERVATIONS:
+            raise ValueError(f"Unknown observation {observation!r}, expected one of {OBSERVATIONS}")
+        self.n = n
+        self.observation = observation
+        self.sim = BatchSimulator(n, seed)
+        self.onehot = np.zeros( (n, PLANES, ROWS, COLS), dtype=np.uint8 )
+        self.rewards = np.zeros(n, dtype=np.int64)
+        self.dones = np.zeros(n, dtype=bool)
+        self.final_scores = np.zeros(n, dtype=np.int64)
+        self.masks = np.zeros( (n, len(DIRECTIONS)), dtype=bool )
+        self.planes = np.arange(PLANES, dtype=np.int8).reshape(1, PLANES, 1, 1)
+
+    # Start new games everywhere, returns the observations
+    def reset(self, seed=None):
+        if seed is not None: self.sim.rng = np.random.default_rng(seed)
+        self.sim.reset()
+        return self._observe()
+
+    # Play one action per environment, returns (observations, rewards, dones, info)
+    def step(self, actions):
+        gained, _ = self.sim.step(actions)
+        self.rewards[:] = gained
+        self.dones[:] = self.sim.done
+        # Final scores stay valid for the environments that just finished
+        np.copyto(self.final_scores, self.sim.scores, where=self.dones)
+        if self.dones.any():
+            self.sim.reset(self.dones)
+        return self._observe(), self.rewards, self.dones, {"final_score": self.final_scores}
+
+    # Legal directions of every environment, a (N, 4) bool array
+    def action_masks(self):
+        return self.sim.legal_moves(out=self.masks)
+
+    def _observe(self):
+        boards = self.sim.boards
+        if self.observation == 'exponents':
+            return boards
+        np.equal(boards[:, None], self.planes, out=self.onehot.view(bool))
+        return self.onehot
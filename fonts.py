@@ -0,0 +1,60 @@
+import os
+from lazyimport import lazy_import
+from persistence import JsonStore
+
+pygame = lazy_import("pygame")
+
+# Font of every text of the game
+FONT_NAME = 'comicsans'
+
+# Where the resolved font files are remembered between runs
+FONT_CACHE = "2048-fonts.json"
+
+# Looking a system font up makes pygame list every installed font (fc-list on
+# Linux), which is slow. The file SysFont picks for a name and style is
+# resolved once and written to a small JSON cache, later runs open it directly.
+# Font objects are shared: asking twice for the same size and style returns
+# the same Font. Delete the cache file to look the fonts up again.
+class FontCache:
+
+    def __init__(self, name=FONT_NAME, path=FONT_CACHE):
+        self.name = name
+        self.store = JsonStore(path, flush_interval=0)
+        try:
+            self.store.load()
+        except (OSError, ValueError):
+            self.store.data = {}
+        self.fonts = {}
+
+    # (font file, synthetic bold) picked by SysFont, a None file is pygame's default font
+    def resolve(self, bold):
+        key = f"{self.name}:{'bold' if bold else 'regular'}"
+        entry = self.store.data.get(key)
+        if entry is not None and (entry[0] is None or os.path.exists(entry[0])):
+            return entry
+
+        # Let SysFont choose, and keep what it chose
+        chosen = []
+        def constructor(path, size, set_bold, set_italic):
+            chosen.extend( (path, set_bold) )
+            return pygame.font.Font(path, size)
+        pygame.font.SysFont(self.name, 1, bold, constructor=constructor)
+
+        entry = chosen
+        self.store.update({key: entry})
+        try:
+            self.store.flush()
+        except OSError:
+            # A read-only directory only costs the lookup next time
+            pass
+        return entry
+
+    # Shared Font of a size and style
+    def get(self, size, bold=False):
+        font = self.fonts.get( (size, bold) )
+        if font is None:
+            path, set_bold = self.resolve(bold)
+            font = pygame.font.Font(path, size)
+            if set_bold: font.set_bold(True)
+            self.fonts[(size, bold)] = font
+        return font
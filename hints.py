@@ -0,0 +1,103 @@
+import queue
+import threading
+from collections import OrderedDict
+from lazyimport import load
+
+import ai
+import bitboard
+
+# Move hints computed off the main thread. The expectimax search runs on a
+# worker thread; the caller asks for the best move of a packed bitboard with
+# request(), which answers at once from the cache or queues the search.
+# Finished searches come back through a results queue, read by poll() on the
+# caller's thread, and notify() is called so a loop waiting for input can
+# wake up. Asking for another board cancels the search that is running.
+#
+#   worker = HintWorker(notify=wake_up)
+#   worker.request(board)   # direction or None while it's being searched
+#   worker.poll()           # later, in the main loop: the finished (board, direction)
+
+# Seconds a search may take, it deepens until then
+HINT_TIME = 0.25
+# Hints kept in the cache (least recently used go first)
+HINT_CACHE_SIZE = 10000
+
+class HintWorker:
+
+    def __init__(self, time_limit=HINT_TIME, cache_size=HINT_CACHE_SIZE, notify=None):
+        self.time_limit = time_limit
+        self.cache_size = cache_size
+        self.notify = notify
+        # board -> direction (None when there is no move), only used by the caller's thread
+        self.cache = OrderedDict()
+        # Board the caller wants now; the search of any other one is cancelled
+        self.wanted = None
+        self.closed = False
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        # The game imports bitboard lazily, it has to be loaded before the thread uses it
+        load(bitboard)
+        self.thread = threading.Thread(target=self._run, name="hint-worker", daemon=True)
+        self.thread.start()
+
+    # Best direction for a packed board if it is known, else the search is
+    # queued (unless it already is) and None returned
+    def request(self, board):
+        if board in self.cache:
+            self.cache.move_to_end(board)
+            return self.cache[board]
+        if board != self.wanted:
+            self.wanted = board
+            self.requests.put(board)
+        return None
+
+    # Whether a hint was requested and not found yet
+    def searching(self):
+        return self.wanted is not None
+
+    # Stop looking for the hint that was requested
+    def cancel(self):
+        self.wanted = None
+
+    # Move the finished searches to the cache, returns them as (board, direction) pairs
+    def poll(self):
+        done = []
+        while True:
+            try:
+                board, direction = self.results.get_nowait()
+            except queue.Empty:
+                break
+            self.cache[board] = direction
+            self.cache.move_to_end(board)
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            if board == self.wanted: self.wanted = None
+            done.append( (board, direction) )
+        return done
+
+    # Stop the worker thread
+    def close(self):
+        self.closed = True
+        self.wanted = None
+        self.requests.put(None)
+        self.thread.join()
+
+    def _run(self):
+        board = None
+        player = ai.ExpectimaxPlayer(time_limit=self.time_limit,
+                                     should_stop=lambda: self.closed or self.wanted != board)
+        while True:
+            board = self.requests.get()
+            # Only the latest request matters
+            while not self.requests.empty():
+                board = self.requests.get_nowait()
+            if board is None or self.closed:
+                return
+            if board != self.wanted:
+                continue
+            try:
+                direction = player.best_move_board(board)
+            except ai.SearchCancelled:
+                continue
+            self.results.put( (board, direction) )
+            if self.notify is not None: self.notify()
@@ -0,0 +1,99 @@
+from array import array
+
+# Undo/redo history in a fixed size ring buffer. Every entry is a packed board
+# (one or more uint64 words) and the score the move to it gained; the storage
+# is allocated once, so the history never takes more than
+# depth * (8 * words + 8) bytes and the oldest entries are overwritten when
+# it is full. push, undo and redo are O(1).
+#
+# Entries are numbered from the start of the game: entry 0 is the starting
+# board, entry n the board after move n. cursor is the current entry,
+# entries after it up to last can be redone.
+DEPTH = 256
+
+# Bits per cell exponent in boards packed by pack_cells, enough for any tile
+CELL_BITS = 8
+WORD_BITS = 64
+WORD_MASK = (1 << WORD_BITS) - 1
+
+class HistoryRing:
+    __slots__ = ('depth', 'words', 'boards', 'deltas', 'first', 'cursor', 'last')
+
+    def __init__(self, depth=DEPTH, words=1):
+        self.depth = depth
+        self.words = words
+        self.boards = array('Q', bytes(8 * depth * words))
+        self.deltas = array('q', bytes(8 * depth))
+        self.reset(0)
+
+    # Bytes of the ring storage
+    def nbytes(self):
+        return self.boards.itemsize * len(self.boards) + self.deltas.itemsize * len(self.deltas)
+
+    # Forget everything, board is the new starting board
+    def reset(self, board):
+        self.first = self.cursor = self.last = 0
+        self.__write(0, board, 0)
+
+    def __write(self, entry, board, delta):
+        slot = entry % self.depth
+        self.deltas[slot] = delta
+        if self.words == 1:
+            self.boards[slot] = board
+        else:
+            base = slot * self.words
+            for i in range(self.words):
+                self.boards[base + i] = board & WORD_MASK
+                board >>= WORD_BITS
+
+    # Packed board of an entry
+    def board(self, entry):
+        slot = entry % self.depth
+        if self.words == 1:
+            return self.boards[slot]
+        base = slot * self.words
+        board = 0
+        for i in reversed(range(self.words)):
+            board = board << WORD_BITS | self.boards[base + i]
+        return board
+
+    # Add the board after a move that gained delta; the moves that could be redone are dropped
+    def push(self, board, delta):
+        self.cursor += 1
+        self.last = self.cursor
+        # Full: the oldest entry is overwritten
+        if self.last - self.first >= self.depth: self.first += 1
+        self.__write(self.cursor, board, delta)
+
+    def can_undo(self):
+        return self.cursor > self.first
+
+    def can_redo(self):
+        return self.cursor < self.last
+
+    # Step back one move, returns (board, score to take back), None if there is nothing to undo
+    def undo(self):
+        if self.cursor <= self.first: return None
+        delta = self.deltas[self.cursor % self.depth]
+        self.cursor -= 1
+        return self.board(self.cursor), delta
+
+    # Play an undone move again, returns (board, score gained), None if there is nothing to redo
+    def redo(self):
+        if self.cursor >= self.last: return None
+        self.cursor += 1
+        return self.board(self.cursor), self.deltas[self.cursor % self.depth]
+
+# Pack a board of tile values of any size, CELL_BITS per cell exponent
+def pack_cells(tiles):
+    board = 0
+    shift = 0
+    for row in tiles:
+        for value in row:
+            if value: board |= (int(value).bit_length() - 1) << shift
+            shift += CELL_BITS
+    return board
+
+# Words needed by pack_cells for a board size
+def words_for(rows, cols):
+    return -(-rows * cols * CELL_BITS // WORD_BITS)
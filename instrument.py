@@ -0,0 +1,156 @@
+import contextlib
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+
+# Opt-in instrumentation of the hot paths. Nothing is wrapped until enable()
+# is called, so a disabled session runs the original methods untouched.
+#
+#   INSTRUMENTS.enable()
+#   INSTRUMENTS.wrap(Game, 'slide_tiles')
+#   with INSTRUMENTS.section('events'): ...
+#   print(INSTRUMENTS.summary())
+
+# Latencies are counted in power of two buckets of microseconds: bucket i
+# holds calls that took less than 2 ** i us
+BUCKETS = 32
+
+# seconds between two exports to the export file
+EXPORT_INTERVAL = 10.0
+
+# Call count, total time and latency histogram of one instrumented path
+class PathStats:
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.histogram = [0] * BUCKETS
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.histogram[min(int(seconds * 1e6).bit_length(), BUCKETS - 1)] += 1
+
+    # Upper bound of the latency (seconds) below which the given share of calls fall
+    def percentile(self, share):
+        wanted = share * self.count
+        seen = 0
+        for i, calls in enumerate(self.histogram):
+            seen += calls
+            if calls and seen >= wanted: return (1 << i) / 1e6
+        return 0.0
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(0.5),
+            "p99": self.percentile(0.99),
+            "histogram_us": {str(1 << i): calls for i, calls in enumerate(self.histogram) if calls},
+        }
+
+class Instruments:
+
+    def __init__(self):
+        self.enabled = False
+        self.stats = {}
+        # Wrapped paths can run on other threads (e.g. the stats writer), the
+        # stats are only read and changed under this lock
+        self.lock = threading.Lock()
+        self.export_path = None
+        self.export_interval = EXPORT_INTERVAL
+        self.last_export = time.monotonic()
+
+    # Start collecting, optionally exporting the stats to a JSON file every interval seconds
+    def enable(self, export_path=None, export_interval=EXPORT_INTERVAL):
+        self.enabled = True
+        self.export_path = export_path
+        self.export_interval = export_interval
+
+    def record(self, label, seconds):
+        with self.lock:
+            stats = self.stats.get(label)
+            if stats is None:
+                stats = self.stats[label] = PathStats()
+            stats.add(seconds)
+
+    # Replace owner.name (a method or function) by a timed version. Does nothing when disabled.
+    def wrap(self, owner, name, label=None):
+        if not self.enabled: return
+        func = getattr(owner, name)
+        label = label or f"{getattr(owner, '__name__', owner)}.{name}"
+        record = self.record
+        perf_counter = time.perf_counter
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(label, perf_counter() - start)
+
+        setattr(owner, name, timed)
+
+    # Context manager timing a block of code, a shared no-op when disabled
+    def section(self, label):
+        if not self.enabled: return _NO_SECTION
+        return self._section(label)
+
+    @contextlib.contextmanager
+    def _section(self, label):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(label, time.perf_counter() - start)
+
+    # One line per path, slowest total first
+    def summary(self, limit=None):
+        lines = []
+        with self.lock:
+            ranked = sorted(self.stats.items(), key=lambda item: item[1].total, reverse=True)
+            for label, stats in ranked[:limit]:
+                lines.append(f"{label}: {stats.count} calls, mean {1e6 * stats.total / stats.count:.0f} us, "
+                             f"p99 < {1e6 * stats.percentile(0.99):.0f} us")
+        return lines
+
+    # Write the stats as JSON (atomically, through a temporary file)
+    def export(self, path=None):
+        path = path or self.export_path
+        if path is None: return
+        with self.lock:
+            data = {label: stats.as_dict() for label, stats in self.stats.items()}
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(data, file, indent=2)
+        os.replace(tmp_path, path)
+        self.last_export = time.monotonic()
+
+    # Export if the export interval has passed
+    def maybe_export(self):
+        if self.export_path and time.monotonic() - self.last_export >= self.export_interval:
+            self.export()
+
+_NO_SECTION = contextlib.nullcontext()
+
+INSTRUMENTS = Instruments()
+
+# Run the block under cProfile and write the stats to path on exit (even on sys.exit)
+@contextlib.contextmanager
+def profile_session(path):
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        print("Profile written to", path)
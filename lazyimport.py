@@ -0,0 +1,30 @@
+import importlib.util
+import sys
+
+# Import a module on first use: the module object is returned right away and
+# its code only runs the first time one of its attributes is read. Used for
+# modules that are slow to import (pygame, the bitboard tables) and not needed
+# on every path, e.g. the default engine or a headless tool.
+#
+#   bitboard = lazy_import("bitboard")
+def lazy_import(name):
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+# Finish loading a module returned by lazy_import now. Two threads reading a
+# lazy module at the same time can see it partly initialized, so modules that
+# a worker thread uses are loaded before it starts.
+def load(module):
+    # Reading any attribute runs the module's code
+    getattr(module, "__name__")
+    return module
@@ -0,0 +1,90 @@
+from concurrent.futures import ProcessPoolExecutor
+import bitboard
+from rng import RngStream
+
+# Monte Carlo player: every direction is scored by the mean final score of
+# random games played to the end after it. Rollouts are cut into fixed size
+# chunks with their own seeded RNG, so the result for a seed is the same
+# whatever the number of workers running the chunks.
+CHUNK_SIZE = 25
+
+# Play one random game from board (a tile still has to spawn), returns the score gained
+def random_game(board, rng):
+    board = bitboard.spawn(board, rng)
+    score = 0
+    while True:
+        moves = []
+        for direction in bitboard.DIRECTIONS:
+            new, gained, moved = bitboard.move(board, direction)
+            if moved: moves.append( (new, gained) )
+        if not moves: return score
+        board, gained = moves[rng.randrange(0, len(moves))]
+        score += gained
+        board = bitboard.spawn(board, rng)
+
+# Worker task: play count random games with the RNG stream of this chunk only
+def rollout_chunk(board, count, rng):
+    return sum(random_game(board, rng) for _ in range(count))
+
+class MonteCarloPlayer:
+
+    # rollouts is the number of random games per direction. workers > 1 spreads
+    # the chunks over a process pool (None uses every core).
+    def __init__(self, rollouts=200, workers=None, seed=0):
+        self.rollouts = rollouts
+        self.workers = workers
+        self.seed = seed
+        # Number of decisions taken, part of every chunk seed
+        self.decisions = 0
+        self.pool = None
+        if workers is None or workers > 1:
+            self.pool = ProcessPoolExecutor(max_workers=workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Shut the process pool down
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    # Best direction for a board in the same form as Game.tiles, None if no move is left
+    def best_move(self, tiles):
+        return self.best_move_board(bitboard.pack(tiles))
+
+    # Best direction for a packed bitboard
+    def best_move_board(self, board):
+        scores = self.score_moves(board)
+        if not scores: return None
+        return max(scores, key=scores.get)
+
+    # Mean final score of every legal direction
+    def score_moves(self, board):
+        decision = self.decisions
+        self.decisions += 1
+
+        tasks = []
+        gained = {}
+        for direction in bitboard.DIRECTIONS:
+            new, score, moved = bitboard.move(board, direction)
+            if not moved: continue
+            gained[direction] = score
+            for chunk, start in enumerate(range(0, self.rollouts, CHUNK_SIZE)):
+                count = min(CHUNK_SIZE, self.rollouts - start)
+                rng = RngStream(self.seed, decision, direction, chunk)
+                tasks.append( (direction, new, count, rng) )
+
+        if self.pool is None:
+            totals = [rollout_chunk(new, count, rng) for _, new, count, rng in tasks]
+        else:
+            futures = [self.pool.submit(rollout_chunk, new, count, rng) for _, new, count, rng in tasks]
+            totals = [future.result() for future in futures]
+
+        sums = dict.fromkeys(gained, 0)
+        for (direction, _, _, _), total in zip(tasks, totals):
+            sums[direction] += total
+        return {direction: gained[direction] + sums[direction] / self.rollouts for direction in gained}
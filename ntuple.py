@@ -0,0 +1,281 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+
+import bitboard
+from persistence import JsonStore
+from rng import RngStream
+
+# N-tuple network player trained with TD(0) afterstate learning.
+#
+# The value of a board is the sum of one weight per (tuple, symmetry): every
+# tuple is a set of cells whose tile exponents form an index into its weight
+# table, and it is read in all 8 rotations/reflections of the board. Weights
+# are float32 tables stored in one file that is memory-mapped, so evaluation
+# processes opened read-only share a single copy and start immediately.
+# The tuples and the seed are kept next to it in a JSON file.
+#
+# Training works on a private copy-on-write mapping, so nothing reaches the
+# file between two checkpoints. A checkpoint writes the weights and the number
+# of games they have learned (a trailer after the weights) to a new file that
+# replaces the old one, so after a crash the file is always a consistent
+# checkpoint and resuming plays the same games as an uninterrupted run.
+
+# Cells are numbered 4 * row + col
+TUPLE_SETS = {
+    # 4 six-cell tuples, 4 x 16**6 weights (256 MB)
+    'default': [(0, 1, 2, 3, 4, 5), (4, 5, 6, 7, 8, 9), (0, 1, 2, 4, 5, 6), (4, 5, 6, 8, 9, 10)],
+    # rows and squares of four cells, 5 x 16**4 weights (1.25 MB), for quick runs
+    'small': [(0, 1, 2, 3), (4, 5, 6, 7), (0, 1, 4, 5), (1, 2, 5, 6), (5, 6, 9, 10)],
+}
+
+LEARNING_RATE = 0.1
+CHECKPOINT_EVERY = 1000
+WEIGHT_SIZE = 4
+# After the weights: magic and games learned
+TRAILER = struct.Struct("<8sQ")
+TRAILER_MAGIC = b"2048NTW\x00"
+
+# The 8 symmetries of a cell (row, col)
+def symmetric_cells(cell):
+    row, col = divmod(cell, 4)
+    return [4 * r + c for r, c in (
+        (row, col), (row, 3 - col), (3 - row, col), (3 - row, 3 - col),
+        (col, row), (col, 3 - row), (3 - col, row), (3 - col, 3 - row),
+    )]
+
+class NTupleNetwork:
+
+    # Use create() or open() rather than calling this directly
+    def __init__(self, path, tuples, file, buffer, readonly):
+        self.path = path
+        self.tuples = [tuple(t) for t in tuples]
+        self.file = file
+        self.buffer = buffer
+        self.readonly = readonly
+
+        # One feature per tuple and symmetry: the start of its table and the
+        # bit shifts of its cells in the packed board
+        self.features = []
+        base = 0
+        for cells in self.tuples:
+            for symmetry in range(8):
+                shifts = tuple(4 * symmetric_cells(cell)[symmetry] for cell in cells)
+                self.features.append( (base, shifts) )
+            base += 16 ** len(cells)
+        self.size = base
+        self.weights = memoryview(buffer)[:self.size * WEIGHT_SIZE].cast('f')
+
+        # Tuples and seed
+        self.meta = JsonStore(path + ".json", flush_interval=0)
+        if os.path.exists(self.meta.path):
+            self.meta.load()
+        # Games learned by the weights, from the trailer (files written before
+        # it existed keep the count in the JSON file)
+        self.games = self.meta.data.get("games", 0)
+        if len(buffer) == (self.size * WEIGHT_SIZE) + TRAILER.size:
+            magic, self.games = TRAILER.unpack_from(buffer, self.size * WEIGHT_SIZE)
+            if magic != TRAILER_MAGIC:
+                self.close()
+                raise ValueError(f"{path} has no valid checkpoint trailer")
+
+    # Create a new weights file (all zeros) for a tuple set, opened for training
+    @classmethod
+    def create(cls, path, tuples=TUPLE_SETS['default'], seed=0):
+        size = sum(16 ** len(cells) for cells in tuples)
+        with open(path, "wb") as file:
+            file.truncate(size * WEIGHT_SIZE)
+            file.seek(size * WEIGHT_SIZE)
+            file.write(TRAILER.pack(TRAILER_MAGIC, 0))
+        meta = JsonStore(path + ".json", flush_interval=0)
+        meta.update({"tuples": [list(t) for t in tuples], "seed": seed})
+        meta.flush()
+        return cls.open(path, readonly=False)
+
+    # Map an existing weights file, read-only by default. A network opened
+    # for training gets a private copy of the pages it changes.
+    @classmethod
+    def open(cls, path, readonly=True):
+        with open(path + ".json") as file:
+            tuples = json.load(file)["tuples"]
+        size = sum(16 ** len(cells) for cells in tuples) * WEIGHT_SIZE
+        file = open(path, "rb")
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ if readonly else mmap.ACCESS_COPY)
+        if len(buffer) not in (size, size + TRAILER.size):
+            buffer.close()
+            file.close()
+            raise ValueError(f"{path} holds {len(buffer)} bytes, its tuples need {size}")
+        return cls(path, tuples, file, buffer, readonly)
+
+    def close(self):
+        self.weights.release()
+        self.buffer.close()
+        self.file.close()
+
+    # Value of a packed board
+    def value(self, board):
+        weights = self.weights
+        total = 0.0
+        for base, shifts in self.features:
+            index = 0
+            for i, shift in enumerate(shifts):
+                index |= ((board >> shift) & 0xF) << (4 * i)
+            total += weights[base + index]
+        return total
+
+    # Move every weight of a board by delta (already scaled by the learning rate)
+    def adjust(self, board, delta):
+        weights = self.weights
+        for base, shifts in self.features:
+            index = 0
+            for i, shift in enumerate(shifts):
+                index |= ((board >> shift) & 0xF) << (4 * i)
+            weights[base + index] += delta
+
+    # Best move of a packed board: (direction, afterstate, reward, afterstate value), None if no move is left
+    def best_action(self, board):
+        best = None
+        for direction in bitboard.DIRECTIONS:
+            after, reward, moved = bitboard.move(board, direction)
+            if not moved: continue
+            value = self.value(after)
+            if best is None or reward + value > best[2] + best[3]:
+                best = (direction, after, reward, value)
+        return best
+
+    # Write the weights and the number of games they learned to a new file
+    # that replaces the old one
+    def checkpoint(self, games):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", suffix=".bin", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(self.weights)
+                file.write(TRAILER.pack(TRAILER_MAGIC, games))
+                file.flush()
+                os.fsync(file.fileno())
+            os.chmod(tmp_path, os.stat(self.path).st_mode & 0o777)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.games = games
+
+# Plays with a trained network
+class NTuplePlayer:
+
+    def __init__(self, network):
+        self.network = network
+
+    # Best direction for a board in the same form as Game.tiles, None if no move is left
+    def best_move(self, tiles):
+        best = self.network.best_action(bitboard.pack(tiles))
+        return best[0] if best else None
+
+# TD(0) learning on afterstates: after every move the value of the previous
+# afterstate is pulled towards the reward of the move plus the value of the new afterstate.
+class NTupleTrainer:
+
+    def __init__(self, network, learning_rate=LEARNING_RATE, seed=0):
+        if network.readonly:
+            raise ValueError("the network has to be opened with readonly=False to train")
+        self.network = network
+        # Spread over all the weights a board touches
+        self.step_size = learning_rate / len(network.features)
+        self.seed = seed
+        self.games = network.games
+
+    # Play and learn one game, returns (score, max tile)
+    def train_game(self):
+        network = self.network
+        # Every game has its own RNG stream, so a resumed run continues the same sequence
+        rng = RngStream(self.seed, self.games)
+        board = bitboard.spawn(bitboard.spawn(0, rng, first=True), rng, first=True)
+        score = 0
+        previous = None
+        while True:
+            best = network.best_action(board)
+            if best is None:
+                if previous is not None:
+                    network.adjust(previous, self.step_size * -network.value(previous))
+                break
+            _, after, reward, value = best
+            if previous is not None:
+                network.adjust(previous, self.step_size * (reward + value - network.value(previous)))
+            previous = after
+            score += reward
+            board = bitboard.spawn(after, rng)
+        self.games += 1
+        return score, bitboard.max_tile(board)
+
+    # Train for a number of games, printing progress and saving checkpoints
+    def train(self, games, checkpoint_every=CHECKPOINT_EVERY, log_every=100):
+        start = time.perf_counter()
+        window_start = start
+        scores = []
+        reached = 0
+        for i in range(1, games + 1):
+            score, tile = self.train_game()
+            scores.append(score)
+            reached += tile >= 2048
+            if i % log_every == 0 or i == games:
+                now = time.perf_counter()
+                print(f"game {self.games}: mean score {sum(scores) / len(scores):.0f}, "
+                      f"2048 reached {reached / len(scores):.1%}, {len(scores) / (now - window_start):.2f} games/s")
+                scores, reached, window_start = [], 0, now
+            if i % checkpoint_every == 0:
+                self.network.checkpoint(self.games)
+        self.network.checkpoint(self.games)
+        return games / (time.perf_counter() - start)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="N-tuple network trainer and player for 2048")
+    parser.add_argument("command", choices=("train", "play"))
+    parser.add_argument("--weights", required=True, metavar="PATH", help="weights file (created if missing when training)")
+    parser.add_argument("--tuples", choices=sorted(TUPLE_SETS), default="default", help="tuple set of a new weights file")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--learning-rate", type=float, default=LEARNING_RATE)
+    parser.add_argument("--checkpoint-every", type=int, default=CHECKPOINT_EVERY, help="games between two checkpoints")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.command == "train":
+        # An existing weights file is resumed from its last checkpoint, with its seed
+        seed = args.seed
+        if os.path.exists(args.weights):
+            network = NTupleNetwork.open(args.weights, readonly=False)
+            seed = network.meta.data.get("seed", seed)
+            print(f"Resuming after {network.games} games")
+        else:
+            network = NTupleNetwork.create(args.weights, TUPLE_SETS[args.tuples], seed)
+        trainer = NTupleTrainer(network, args.learning_rate, seed)
+        rate = trainer.train(args.games, args.checkpoint_every)
+        print(f"{rate:.2f} games/s")
+        network.close()
+        return 0
+
+    network = NTupleNetwork.open(args.weights)
+    player = NTuplePlayer(network)
+    rng = RngStream(args.seed)
+    total = 0
+    for i in range(args.games):
+        board = bitboard.spawn(bitboard.spawn(0, rng, first=True), rng, first=True)
+        score = 0
+        while True:
+            best = network.best_action(board)
+            if best is None: break
+            score += best[2]
+            board = bitboard.spawn(best[1], rng)
+        total += score
+        print(f"game {i + 1}: score {score}, max tile {bitboard.max_tile(board)}")
+    print(f"mean score {total / max(args.games, 1):.0f}")
+    network.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
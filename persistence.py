@@ -0,0 +1,68 @@
+import json
+import os
+import tempfile
+import time
+
+# seconds between two writes of pending changes
+FLUSH_INTERVAL = 30.0
+
+# Keeps a small JSON document in memory and writes it behind: changes only
+# mark the store dirty, the file is written at most once per flush_interval
+# or when flush() is called. Every write goes to a temporary file in the same
+# directory that replaces the old file, so a crash never leaves a truncated file.
+class JsonStore:
+
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.data = {}
+        self.dirty = False
+        self.last_flush = time.monotonic()
+        # Number of times the file was written
+        self.writes = 0
+
+    # Read the file, raises FileNotFoundError when there is none
+    def load(self):
+        with open(self.path, "r") as file:
+            self.data = json.load(file)
+        self.dirty = False
+        return self.data
+
+    # Change some values, the file is written later
+    def update(self, values):
+        if all(self.data.get(key) == value for key, value in values.items()):
+            return
+        self.data.update(values)
+        self.dirty = True
+        self.maybe_flush()
+
+    # Write pending changes if the flush interval has passed
+    def maybe_flush(self):
+        if self.dirty and time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    # Write pending changes now, returns True if the file was written
+    def flush(self):
+        if not self.dirty:
+            return False
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", suffix=".json", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as file:
+                json.dump(self.data, file)
+                file.flush()
+                os.fsync(file.fileno())
+            # mkstemp makes the file private, keep the mode of the file it replaces
+            try:
+                mode = os.stat(self.path).st_mode & 0o777
+            except FileNotFoundError:
+                mode = 0o644
+            os.chmod(tmp_path, mode)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.dirty = False
+        self.last_flush = time.monotonic()
+        self.writes += 1
+        return True
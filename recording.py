@@ -0,0 +1,181 @@
+import struct
+import bitboard
+
+# Binary game recordings. A recording file starts with FILE_HEADER and holds
+# any number of games appended one after the other:
+#
+#   GAME_START, seed (uint64), starting board (packed uint64, see bitboard.py)
+#   one byte per move
+#   GAME_END
+#
+# A move byte keeps the direction in bits 0-1 (index into DIRECTIONS). If the
+# move changed the board, bits 2-5 hold the cell that received the new tile
+# (4 * row + col) and bit 6 is 0 for a 2 and 1 for a 4. If the move changed
+# nothing, bit 7 is set and no tile was spawned.
+FILE_HEADER = b"2048REC\x01"
+GAME_START = 0xFE
+GAME_END = 0xFF
+NO_SPAWN = 0x80
+GAME_HEADER = struct.Struct("<QQ")
+
+DIRECTIONS = bitboard.DIRECTIONS
+DIRECTION_INDEX = {direction: i for i, direction in enumerate(DIRECTIONS)}
+
+# Encode one move and the tile spawned after it (cell None when nothing spawned)
+def encode_move(direction, cell=None, exp=1):
+    if cell is None:
+        return DIRECTION_INDEX[direction] | NO_SPAWN
+    return DIRECTION_INDEX[direction] | cell << 2 | (exp - 1) << 6
+
+# Apply a move byte to a board, returns (new board, score gained)
+def apply_move(board, code):
+    board, score, _ = bitboard.move(board, DIRECTIONS[code & 3])
+    if not code & NO_SPAWN:
+        board |= (((code >> 6) & 1) + 1) << (4 * ((code >> 2) & 0xF))
+    return board, score
+
+# Appends games to a binary stream. Nothing but the current move is kept in memory.
+class Recorder:
+
+    def __init__(self, file):
+        self.file = file
+        if file.tell() == 0:
+            file.write(FILE_HEADER)
+        # Direction of a move waiting for its spawned tile
+        self.pending = None
+        self.recording = False
+
+    # Open a recording file for appending
+    @classmethod
+    def open(cls, path):
+        return cls(open(path, "ab"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Start a new game from a packed board
+    def begin_game(self, seed, board):
+        if self.recording: self.end_game()
+        self.file.write(bytes([GAME_START]) + GAME_HEADER.pack(seed & 0xFFFFFFFFFFFFFFFF, board))
+        self.pending = None
+        self.recording = True
+
+    # Record a move, a move that changed the board is written with the next spawn
+    def move(self, direction, moved=True):
+        if not self.recording: return
+        if moved:
+            self.pending = direction
+        else:
+            self.file.write(bytes([encode_move(direction)]))
+
+    # Record the tile spawned after the last move (exp 1 for a 2, 2 for a 4)
+    def spawn(self, cell, exp):
+        # Tiles spawned before the first move are part of the starting board
+        if not self.recording or self.pending is None: return
+        self.file.write(bytes([encode_move(self.pending, cell, exp)]))
+        self.pending = None
+
+    # Close the current game
+    def end_game(self):
+        if not self.recording: return
+        self.file.write(bytes([GAME_END]))
+        self.file.flush()
+        self.recording = False
+
+    def close(self):
+        self.end_game()
+        self.file.close()
+
+# One recorded game: its seed, starting board and move bytes
+class GameRecord:
+
+    def __init__(self, seed, board, moves, complete=True):
+        self.seed = seed
+        self.board = board
+        self.moves = moves
+        # False when the file ended before GAME_END (e.g. after a crash)
+        self.complete = complete
+
+    def __len__(self):
+        return len(self.moves)
+
+# Read the games of a recording file one by one
+def read_games(path, block_size=1 << 20):
+    with open(path, "rb") as file:
+        if file.read(len(FILE_HEADER)) != FILE_HEADER:
+            raise ValueError(f"{path} is not a 2048 recording")
+        buffer = b""
+        eof = False
+        while True:
+            # Game header
+            while len(buffer) < 1 + GAME_HEADER.size and not eof:
+                block = file.read(block_size)
+                eof = not block
+                buffer += block
+            if not buffer: return
+            if buffer[0] != GAME_START or len(buffer) < 1 + GAME_HEADER.size:
+                raise ValueError(f"{path} is damaged")
+            seed, board = GAME_HEADER.unpack_from(buffer, 1)
+            buffer = buffer[1 + GAME_HEADER.size:]
+
+            # Move bytes up to GAME_END
+            moves = bytearray()
+            while True:
+                end = buffer.find(GAME_END)
+                if end >= 0:
+                    moves += buffer[:end]
+                    buffer = buffer[end + 1:]
+                    yield GameRecord(seed, board, bytes(moves))
+                    break
+                moves += buffer
+                buffer = file.read(block_size)
+                if not buffer:
+                    yield GameRecord(seed, board, bytes(moves), complete=False)
+                    return
+
+# Replays a recorded game without a screen. Every checkpoint_interval moves the
+# board and score are kept, so seeking starts from the closest checkpoint.
+class Replayer:
+
+    def __init__(self, record, checkpoint_interval=256):
+        self.record = record
+        self.checkpoint_interval = checkpoint_interval
+        # (board, score) after 0, interval, 2 * interval, ... moves
+        self.checkpoints = [(record.board, 0)]
+
+    def __len__(self):
+        return len(self.record)
+
+    # Packed board and score after the first index moves
+    def seek(self, index):
+        if not 0 <= index <= len(self.record):
+            raise IndexError(f"move {index} out of range 0..{len(self.record)}")
+        moves = self.record.moves
+        interval = self.checkpoint_interval
+
+        # Build the missing checkpoints up to index
+        while (len(self.checkpoints) - 1) * interval + interval <= index:
+            start = (len(self.checkpoints) - 1) * interval
+            board, score = self.checkpoints[-1]
+            for code in moves[start:start + interval]:
+                board, gained = apply_move(board, code)
+                score += gained
+            self.checkpoints.append( (board, score) )
+
+        start = index // interval * interval
+        board, score = self.checkpoints[index // interval]
+        for code in moves[start:index]:
+            board, gained = apply_move(board, code)
+            score += gained
+        return board, score
+
+    # Board and score at the end of the game
+    def final(self):
+        return self.seek(len(self.record))
+
+    # Board after index moves in the same form as Game.tiles
+    def tiles(self, index):
+        return bitboard.unpack(self.seek(index)[0])
@@ -0,0 +1,43 @@
+import random
+
+# Seedable random streams that split into independent child streams, the
+# seeding scheme shared by the game, the workers and the tools. A stream is a
+# random.Random keyed by its root seed and the path of keys that led to it:
+#
+#   game = RngStream(7)             # same numbers as random.Random(7)
+#   worker = game.split(3)          # key "7-3", same as random.Random("7-3")
+#   worker.split(12)                # key "7-3-12"
+#
+# String keys are hashed by random.Random (SHA-512), the same in every process
+# and on every platform, so a child stream only depends on its key: splitting
+# doesn't consume numbers from the parent, and worker N gets the same stream
+# whatever the number of workers or the order they start in.
+
+# Bits of the root seeds picked when none is given (they fit in an SQLite INTEGER)
+SEED_BITS = 63
+
+class RngStream(random.Random):
+
+    # seed None picks a random root seed, kept in seed_value so the stream can be played again
+    def __init__(self, seed=None, *path):
+        if seed is None: seed = random.SystemRandom().getrandbits(SEED_BITS)
+        self.seed_value = seed
+        self.path = path
+        # A root stream is seeded with the seed itself, like random.Random(seed)
+        super().__init__(self.key() if path else seed)
+
+    # Key of the stream: root seed and path joined with '-'
+    def key(self):
+        return "-".join(str(part) for part in (self.seed_value,) + self.path)
+
+    # Independent stream for the given keys (e.g. a worker or game number)
+    def split(self, *keys):
+        return RngStream(self.seed_value, *self.path, *keys)
+
+    # One independent stream per index, for n workers
+    def streams(self, n):
+        return [self.split(i) for i in range(n)]
+
+    # Pickled with its key and current state, so a stream sent to a worker process goes on where it was
+    def __reduce__(self):
+        return (RngStream, (self.seed_value,) + self.path, self.getstate())
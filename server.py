@@ -0,0 +1,403 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import sys
+import tempfile
+import time
+
+import bitboard
+from history import HistoryRing
+from instrument import PathStats
+from persistence import JsonStore, FLUSH_INTERVAL
+
+# Game server hosting many independent games in one process, without pygame.
+# Clients speak JSON lines over TCP: one request object per line, one reply
+# object per line.
+#
+#   {"cmd": "new", "seed": 7}                      -> {"ok": true, "session": 1, "board": [[...]], "score": 0, "over": false}
+#   {"cmd": "move", "session": 1, "direction": "UP"} -> same fields, plus "moved"
+#   {"cmd": "state", "session": 1}
+#   {"cmd": "undo", "session": 1}                  -> takes back the last move
+#   {"cmd": "redo", "session": 1}                  -> plays an undone move again
+#   {"cmd": "end", "session": 1}                   -> ends the game and enters it in the leaderboard
+#   {"cmd": "leaderboard"}
+#   {"cmd": "stats"}                               -> latency per command, sessions and bytes per session
+#
+# Errors are replied as {"ok": false, "error": "..."}, and the connection
+# goes on. Sessions belong to the connection that created them and end when
+# it closes.
+
+HOST, PORT = "127.0.0.1", 2048
+
+# Longest request line in bytes, longer ones are dropped with an error reply
+LINE_LIMIT = 64 * 1024
+
+# Games kept in the leaderboard
+TOP_SIZE = 10
+
+# Moves a session can undo
+UNDO_DEPTH = 16
+
+# A game is one packed 4x4 board (see bitboard.py), its score and a small
+# undo/redo ring of packed boards. Spawns don't keep a random.Random per
+# session (it holds 2.5 KB of state): the tile after move n comes from a
+# generator seeded with (seed, n), so a game is reproducible from its seed and
+# undoing a move doesn't draw another tile.
+class Session:
+    __slots__ = ('id', 'seed', 'board', 'score', 'history', 'over')
+
+    def __init__(self, id, seed):
+        self.id = id
+        self.seed = seed
+        self.score = 0
+        self.history = HistoryRing(UNDO_DEPTH + 1)
+        rng = self.rng(0)
+        # The two first tiles are always 2's, like Game.generate_tiles(True)
+        self.board = bitboard.spawn(bitboard.spawn(0, rng, first=True), rng, first=True)
+        self.history.reset(self.board)
+        self.over = bitboard.is_game_over(self.board)
+
+    # Moves from the start to the current board
+    @property
+    def moves(self):
+        return self.history.cursor
+
+    # Generator of the tile spawned after a move
+    def rng(self, move):
+        return random.Random(self.seed << 32 | move)
+
+    # Play a move, returns True if the board changed
+    def move(self, direction):
+        board, score, moved = bitboard.move(self.board, direction)
+        if not moved: return False
+        self.score += score
+        self.board = bitboard.spawn(board, self.rng(self.moves + 1))
+        self.history.push(self.board, score)
+        self.over = bitboard.is_game_over(self.board)
+        return True
+
+    # Take back the last move, returns True if there was one
+    def undo(self):
+        step = self.history.undo()
+        if step is None: return False
+        self.board, delta = step
+        self.score -= delta
+        self.over = False
+        return True
+
+    # Play an undone move again, returns True if there was one
+    def redo(self):
+        step = self.history.redo()
+        if step is None: return False
+        self.board, delta = step
+        self.score += delta
+        self.over = bitboard.is_game_over(self.board)
+        return True
+
+    def state(self):
+        return {"session": self.id, "board": bitboard.unpack(self.board), "score": self.score,
+                "moves": self.moves, "max_tile": bitboard.max_tile(self.board), "over": self.over}
+
+    # Bytes held by the session object and its values
+    def size(self):
+        total = sys.getsizeof(self)
+        for name in self.__slots__:
+            total += sys.getsizeof(getattr(self, name))
+        history = self.history
+        return total + sys.getsizeof(history.boards) + sys.getsizeof(history.deltas)
+
+# Best scores of all the sessions, combined in memory and written behind to
+# one JSON file, in the same keys as the game's 2048.json plus the top games
+class Leaderboard:
+
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL):
+        self.store = JsonStore(path, flush_interval)
+        try:
+            self.store.load()
+        except (FileNotFoundError, ValueError):
+            self.store.data = {}
+        self.best = self.store.data.get("best_score", 0)
+        self.played_round = self.store.data.get("played_round", 0)
+        self.top = self.store.data.get("top", [])
+
+    # Enter a finished game
+    def add(self, session):
+        self.played_round += 1
+        self.best = max(self.best, session.score)
+        if len(self.top) < TOP_SIZE or session.score > self.top[-1]["score"]:
+            self.top.append({"score": session.score, "max_tile": bitboard.max_tile(session.board),
+                             "moves": session.moves, "seed": session.seed})
+            self.top.sort(key=lambda game: game["score"], reverse=True)
+            del self.top[TOP_SIZE:]
+        self.store.update({"best_score": self.best, "played_round": self.played_round, "top": list(self.top)})
+
+    def as_dict(self):
+        return {"best_score": self.best, "played_round": self.played_round, "top": self.top}
+
+class GameServer:
+
+    def __init__(self, scores_path="server-scores.json", flush_interval=FLUSH_INTERVAL):
+        self.sessions = {}
+        self.next_id = 1
+        self.leaderboard = Leaderboard(scores_path, flush_interval)
+        # Processing time of every command, from the parsed request to the reply
+        self.stats = {}
+        self.commands = {
+            "new": self.cmd_new,
+            "move": self.cmd_move,
+            "state": self.cmd_state,
+            "undo": self.cmd_undo,
+            "redo": self.cmd_redo,
+            "end": self.cmd_end,
+            "leaderboard": self.cmd_leaderboard,
+            "stats": self.cmd_stats,
+        }
+
+    def new_session(self, seed=None):
+        if seed is None: seed = random.getrandbits(32)
+        session = Session(self.next_id, seed)
+        self.next_id += 1
+        self.sessions[session.id] = session
+        return session
+
+    # Remove a session and enter its game in the leaderboard
+    def end_session(self, session_id):
+        session = self.sessions.pop(session_id)
+        if session.moves: self.leaderboard.add(session)
+        return session
+
+    # Answer one request, owned is the set of sessions of the connection
+    def handle(self, request, owned):
+        if not isinstance(request, dict):
+            raise ValueError("a request must be a JSON object")
+        name = request.get("cmd")
+        if not isinstance(name, str) or name not in self.commands:
+            raise ValueError(f"unknown command {name!r}, expected one of {sorted(self.commands)}")
+        return self.commands[name](request, owned)
+
+    def session(self, request, owned):
+        session_id = request.get("session")
+        if not isinstance(session_id, int) or isinstance(session_id, bool) or session_id not in owned:
+            raise ValueError(f"no session {session_id!r} on this connection")
+        return self.sessions[session_id]
+
+    def cmd_new(self, request, owned):
+        seed = request.get("seed")
+        if seed is not None and (not isinstance(seed, int) or not 0 <= seed < 1 << 32):
+            raise ValueError("seed must be an integer from 0 to 2**32 - 1")
+        session = self.new_session(seed)
+        owned.add(session.id)
+        return session.state()
+
+    def cmd_move(self, request, owned):
+        session = self.session(request, owned)
+        direction = request.get("direction")
+        if isinstance(direction, int) and 0 <= direction < len(bitboard.DIRECTIONS):
+            direction = bitboard.DIRECTIONS[direction]
+        elif isinstance(direction, str) and direction.upper() in bitboard.DIRECTIONS:
+            direction = direction.upper()
+        else:
+            raise ValueError(f"direction must be one of {bitboard.DIRECTIONS} or its index")
+        if session.over:
+            raise ValueError("the game is over")
+        moved = session.move(direction)
+        reply = session.state()
+        reply["moved"] = moved
+        return reply
+
+    def cmd_state(self, request, owned):
+        return self.session(request, owned).state()
+
+    def cmd_undo(self, request, owned):
+        session = self.session(request, owned)
+        undone = session.undo()
+        reply = session.state()
+        reply["undone"] = undone
+        return reply
+
+    def cmd_redo(self, request, owned):
+        session = self.session(request, owned)
+        redone = session.redo()
+        reply = session.state()
+        reply["redone"] = redone
+        return reply
+
+    def cmd_end(self, request, owned):
+        session = self.session(request, owned)
+        owned.discard(session.id)
+        return self.end_session(session.id).state()
+
+    def cmd_leaderboard(self, request, owned):
+        return self.leaderboard.as_dict()
+
+    def cmd_stats(self, request, owned):
+        sizes = [session.size() for session in self.sessions.values()]
+        return {
+            "sessions": len(self.sessions),
+            "bytes_per_session": sum(sizes) / len(sizes) if sizes else 0,
+            "commands": {name: stats.as_dict() for name, stats in self.stats.items()},
+        }
+
+    # Serve one connection
+    async def serve_client(self, reader, writer):
+        owned = set()
+        perf_counter = time.perf_counter
+        try:
+            while True:
+                try:
+                    line = await read_line(reader)
+                except ValueError as error:
+                    writer.write(json.dumps({"ok": False, "error": str(error)}).encode() + b"\n")
+                    await writer.drain()
+                    continue
+                if not line: break
+                start = perf_counter()
+                name = None
+                try:
+                    request = json.loads(line)
+                    reply = self.handle(request, owned)
+                    name = request["cmd"]
+                    reply["ok"] = True
+                # A bad request only gets an error reply, the connection and its sessions go on
+                except ValueError as error:
+                    reply = {"ok": False, "error": str(error)}
+                except (TypeError, KeyError) as error:
+                    reply = {"ok": False, "error": f"invalid request: {type(error).__name__}: {error}"}
+                writer.write(json.dumps(reply).encode() + b"\n")
+                if name is not None:
+                    stats = self.stats.get(name)
+                    if stats is None:
+                        stats = self.stats[name] = PathStats()
+                    stats.add(perf_counter() - start)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            for session_id in owned:
+                self.end_session(session_id)
+            writer.close()
+
+    # Write the leaderboard behind while serving
+    async def flush_scores(self):
+        while True:
+            await asyncio.sleep(1.0)
+            self.leaderboard.store.maybe_flush()
+
+    # Serve until interrupted (Ctrl+C or SIGTERM), then write the leaderboard
+    async def serve(self, host=HOST, port=PORT):
+        server = await asyncio.start_server(self.serve_client, host, port, limit=LINE_LIMIT)
+        flusher = asyncio.create_task(self.flush_scores())
+        stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                asyncio.get_running_loop().add_signal_handler(signum, stop.set)
+            except NotImplementedError:
+                # Windows: Ctrl+C still raises KeyboardInterrupt
+                pass
+        print(f"Serving on {host}:{server.sockets[0].getsockname()[1]}")
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            flusher.cancel()
+            self.leaderboard.store.flush()
+
+# Next line from a client, b"" once it has closed the connection. A line
+# longer than the reader's limit is read to its end and dropped, then
+# ValueError is raised.
+async def read_line(reader):
+    too_long = False
+    while True:
+        try:
+            line = await reader.readuntil(b"\n")
+        except asyncio.IncompleteReadError as error:
+            # Closed, possibly after a last line without a newline
+            return b"" if too_long else error.partial
+        except asyncio.LimitOverrunError as error:
+            too_long = True
+            await reader.readexactly(error.consumed)
+            continue
+        if too_long: raise ValueError(f"request longer than {LINE_LIMIT} bytes")
+        return line
+
+# Opens many connections to a server, each playing one game with random moves,
+# and reports the round trip latency of the moves and the server's stats
+async def load_test(host, port, clients, moves, seed=0):
+    latencies = []
+    finished = []
+    stats_taken = asyncio.Event()
+
+    async def client(index):
+        rng = random.Random(f"{seed}-{index}")
+        reader, writer = await asyncio.open_connection(host, port)
+
+        async def call(request):
+            writer.write(json.dumps(request).encode() + b"\n")
+            await writer.drain()
+            return json.loads(await reader.readline())
+
+        session = (await call({"cmd": "new", "seed": index}))["session"]
+        for _ in range(moves):
+            start = time.perf_counter()
+            reply = await call({"cmd": "move", "session": session, "direction": rng.randrange(4)})
+            latencies.append(time.perf_counter() - start)
+            if reply["over"]: break
+        # Keep the session open until the server stats are taken
+        finished.append(index)
+        await stats_taken.wait()
+        writer.close()
+
+    start = time.perf_counter()
+    tasks = [asyncio.create_task(client(i)) for i in range(clients)]
+    while len(finished) < clients:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(b'{"cmd": "stats"}\n')
+    await writer.drain()
+    stats = json.loads(await reader.readline())
+    writer.close()
+    stats_taken.set()
+    await asyncio.gather(*tasks)
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{clients} clients, {len(latencies)} moves in {elapsed:.2f} s ({len(latencies) / elapsed:.0f} moves/s)")
+    print(f"round trip: p50 {1000 * p50:.2f} ms, p99 {1000 * p99:.2f} ms")
+    move = stats["commands"]["move"]
+    print(f"server processing of a move: mean {1e6 * move['mean']:.0f} us, p99 < {1e6 * move['p99']:.0f} us")
+    print(f"{stats['sessions']} sessions open, {stats['bytes_per_session']:.0f} bytes per session")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="2048 game server (JSON lines over TCP)")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--scores", default="server-scores.json", metavar="PATH", help="leaderboard file")
+    parser.add_argument("--load-test", type=int, metavar="CLIENTS", help="run a server and that many clients playing random moves, then report latency and memory")
+    parser.add_argument("--moves", type=int, default=200, help="moves per client in the load test")
+    args = parser.parse_args(argv)
+
+    # The load test runs its own server on a free port, its games are not kept
+    if args.load_test:
+        async def run():
+            with tempfile.TemporaryDirectory() as directory:
+                game_server = GameServer(os.path.join(directory, "scores.json"))
+                server = await asyncio.start_server(game_server.serve_client, args.host, 0, limit=LINE_LIMIT)
+                async with server:
+                    await load_test(args.host, server.sockets[0].getsockname()[1], args.load_test, args.moves)
+        asyncio.run(run())
+        return 0
+
+    try:
+        asyncio.run(GameServer(args.scores).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+import argparse
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+
+# SQLite store of every finished game and of the score counters (best score,
+# rounds played) that used to live in 2048.json.
+#
+# Writes never block the caller: record_game() and set_values() only queue
+# the row, a background thread writes everything queued so far in one
+# transaction. Queries run on the caller's own connection; the database is in
+# WAL mode so they don't wait for the writer.
+#
+#   stats = StatsStore("2048.db", json_path="2048.json")
+#   stats.record_game(score=2520, max_tile=256, moves=212, duration=95.0)
+#   stats.top(10), stats.per_day(), stats.max_tile_distribution()
+
+DB_PATH = "2048.db"
+
+# Most rows written in one transaction
+BATCH_SIZE = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    score INTEGER NOT NULL,
+    max_tile INTEGER NOT NULL,
+    moves INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    seed INTEGER,
+    ended_at REAL NOT NULL,
+    day TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS games_by_score ON games (score);
+CREATE INDEX IF NOT EXISTS games_by_day ON games (day, score);
+CREATE INDEX IF NOT EXISTS games_by_max_tile ON games (max_tile);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+"""
+
+GAME_COLUMNS = "score, max_tile, moves, duration, seed, ended_at, day"
+
+class StatsStore:
+
+    def __init__(self, path=DB_PATH, json_path=None, batch_size=BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        # Number of transactions written by the writer thread
+        self.batches = 0
+        self.db = self.connect()
+        with self.db:
+            self.db.executescript(SCHEMA)
+        if json_path is not None: self.migrate_json(json_path)
+
+        self.queue = queue.Queue()
+        self.writer = threading.Thread(target=self._write_loop, name="stats-writer", daemon=True)
+        self.writer.start()
+
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    # Import best_score and played_round from a 2048.json written by an older
+    # version, once. The JSON file is left as it is.
+    def migrate_json(self, json_path):
+        if self.get_value("migrated_json") or not os.path.exists(json_path):
+            return
+        try:
+            with open(json_path) as file:
+                data = json.load(file)
+        except ValueError:
+            print("Saved data is damaged, not migrated:", json_path)
+            data = {}
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", [
+                ("best_score", max(data.get("best_score", 0), self.get_value("best_score", 0))),
+                ("played_round", data.get("played_round", 0) + self.get_value("played_round", 0)),
+                ("migrated_json", json_path),
+            ])
+
+    # Queue a finished game, returns at once
+    def record_game(self, score, max_tile, moves, duration, seed=None, ended_at=None):
+        if ended_at is None: ended_at = time.time()
+        day = time.strftime("%Y-%m-%d", time.localtime(ended_at))
+        self.queue.put( ("game", (score, max_tile, moves, duration, seed, ended_at, day)) )
+
+    # Queue new values of counters in the meta table, returns at once
+    def set_values(self, values):
+        self.queue.put( ("meta", dict(values)) )
+
+    # Value of a counter as last written
+    def get_value(self, key, default=None):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def _write_loop(self):
+        db = self.connect()
+        running = True
+        while running:
+            # Wait for a first row, then take everything queued meanwhile
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            running = all(kind != "stop" for kind, _ in batch)
+            try:
+                self.write_batch(db, batch)
+            except sqlite3.Error as error:
+                print("Could not write the stats:", error)
+            for _ in batch: self.queue.task_done()
+        db.close()
+
+    # Write queued rows in one transaction
+    def write_batch(self, db, batch):
+        games = [data for kind, data in batch if kind == "game"]
+        values = {}
+        for kind, data in batch:
+            if kind == "meta": values.update(data)
+        with db:
+            if games: db.executemany(f"INSERT INTO games ({GAME_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)", games)
+            if values: db.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", values.items())
+        self.batches += 1
+
+    # Wait until everything queued is written
+    def flush(self):
+        self.queue.join()
+
+    # Write what is queued and stop the writer
+    def close(self):
+        self.queue.put( ("stop", None) )
+        self.writer.join()
+        self.db.close()
+
+    # Best games: (score, max_tile, moves, duration, seed, day) rows, highest score first
+    def top(self, n=10):
+        return self.db.execute(
+            "SELECT score, max_tile, moves, duration, seed, day FROM games ORDER BY score DESC LIMIT ?", (n,)).fetchall()
+
+    # Games per day: (day, games, best score, mean score) rows, oldest day first
+    def per_day(self, since=None):
+        return self.db.execute(
+            "SELECT day, COUNT(*), MAX(score), AVG(score) FROM games WHERE day >= ? GROUP BY day ORDER BY day",
+            (since or "",)).fetchall()
+
+    # Number of games that ended on each max tile: (max_tile, games) rows
+    def max_tile_distribution(self):
+        return self.db.execute("SELECT max_tile, COUNT(*) FROM games GROUP BY max_tile ORDER BY max_tile").fetchall()
+
+    def game_count(self):
+        return self.db.execute("SELECT COUNT(*) FROM games").fetchone()[0]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Statistics of the games played")
+    parser.add_argument("query", choices=("top", "days", "tiles"))
+    parser.add_argument("--db", default=DB_PATH, metavar="PATH")
+    parser.add_argument("-n", type=int, default=10, help="number of games shown by top")
+    parser.add_argument("--since", metavar="YYYY-MM-DD", help="first day shown by days")
+    args = parser.parse_args(argv)
+
+    stats = StatsStore(args.db)
+    if args.query == "top":
+        for score, max_tile, moves, duration, seed, day in stats.top(args.n):
+            print(f"{score:8} {max_tile:6} {moves:6} moves {duration:8.1f} s  {day}  seed {seed}")
+    elif args.query == "days":
+        for day, games, best, mean in stats.per_day(args.since):
+            print(f"{day}  {games:8} games  best {best:8}  mean {mean:10.1f}")
+    else:
+        total = stats.game_count()
+        for max_tile, games in stats.max_tile_distribution():
+            print(f"{max_tile:6} {games:10} {games / total:8.2%}")
+    stats.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+import array
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import zlib
+
+# On-disk cache of the bitboard move tables. Building them runs the merge
+# rules on all 65536 rows, which takes a noticeable part of a second in every
+# process; the cache file is written once and later processes map it
+# read-only, so they start at once and share one physical copy of the pages.
+#
+# File layout (native byte order, which is part of the fingerprint):
+#
+#   header: MAGIC, FORMAT_VERSION, rules fingerprint, CRC32 of the data, data size
+#   data:   the tables one after the other, in TABLES order
+#
+# The rules fingerprint is a CRC of the slide function's results on probe
+# rows covering every tile value, so a change of the merge rules, like a
+# change of the format, makes the file stale and it is rebuilt.
+
+MAGIC = b"2048TBL\x00"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sIIII")
+# The data starts on a 64 byte boundary
+DATA_OFFSET = 64
+
+ENTRIES = 65536
+
+# Name and array type code of every table, in file order
+TABLES = (
+    ("ROW_LEFT", "H"),
+    ("ROW_RIGHT", "H"),
+    ("COL_UP", "Q"),
+    ("COL_DOWN", "Q"),
+    ("SCORE_LEFT", "I"),
+    ("SCORE_RIGHT", "I"),
+)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TABLE_PATH = os.environ.get("MOVE_TABLES_2048", os.path.join(HERE, "move_tables.bin"))
+
+# CRC of slide(line) -> (line, score) on probe rows: every row whose first
+# three cells hold any exponents 0..15 and whose last cell is empty or equal
+# to the third (8192 rows, so every pair of tiles meets at every position and
+# a change for any tile value shows), plus the native byte order the tables
+# are stored in
+def rules_fingerprint(slide):
+    crc = zlib.crc32(sys.byteorder.encode())
+    for a in range(16):
+        for b in range(16):
+            for c in range(16):
+                for d in (0, c):
+                    line, score = slide([a, b, c, d])
+                    crc = zlib.crc32(struct.pack("<4BI", *line, score), crc)
+    return crc
+
+def data_size():
+    return sum(ENTRIES * array.array(code).itemsize for _, code in TABLES)
+
+# Write the tables (lists in TABLES order) to path, atomically
+def save(path, tables, fingerprint):
+    data = b"".join(array.array(code, table).tobytes() for (_, code), table in zip(TABLES, tables))
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, fingerprint, zlib.crc32(data), len(data))
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", suffix=".bin", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(header.ljust(DATA_OFFSET, b"\x00"))
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        # Readable by every user, like the files Python writes in __pycache__
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+# Map the tables of a cache file read-only. Returns a list of memoryviews in
+# TABLES order, None if the file is missing, damaged or stale.
+def open_tables(path, fingerprint):
+    try:
+        with open(path, "rb") as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    size = data_size()
+    if len(buffer) != DATA_OFFSET + size:
+        return None
+    magic, version, file_fingerprint, crc, file_size = HEADER.unpack_from(buffer)
+    if (magic, version, file_fingerprint, file_size) != (MAGIC, FORMAT_VERSION, fingerprint, size):
+        return None
+    data = memoryview(buffer)[DATA_OFFSET:]
+    if zlib.crc32(data) != crc:
+        return None
+
+    views = []
+    offset = 0
+    for _, code in TABLES:
+        length = ENTRIES * array.array(code).itemsize
+        views.append(data[offset:offset + length].cast(code))
+        offset += length
+    return views
+
+# The tables from the cache file, built with build() and written first if the
+# file is missing or stale. When the file can't be written, the built tables
+# are used from memory.
+def load(build, fingerprint, path=TABLE_PATH):
+    views = open_tables(path, fingerprint)
+    if views is not None:
+        return views
+    tables = build()
+    try:
+        save(path, tables, fingerprint)
+    except OSError:
+        return tables
+    return open_tables(path, fingerprint) or tables
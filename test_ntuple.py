@@ -0,0 +1,48 @@
+import os
+import tempfile
+import unittest
+
+from ntuple import NTupleNetwork, NTupleTrainer, TUPLE_SETS
+
+# A training run interrupted after its last checkpoint and resumed has to end
+# with the same weights as a run that was never interrupted
+class ResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def train(self, path, games, checkpoint_every):
+        network = NTupleNetwork.open(path, readonly=False)
+        NTupleTrainer(network, seed=7).train(games, checkpoint_every, log_every=games)
+        network.close()
+
+    def test_resume_matches_uninterrupted_run(self):
+        whole = self.path("whole.bin")
+        NTupleNetwork.create(whole, TUPLE_SETS['small'], seed=7).close()
+        self.train(whole, 6, checkpoint_every=2)
+
+        resumed = self.path("resumed.bin")
+        network = NTupleNetwork.create(resumed, TUPLE_SETS['small'], seed=7)
+        trainer = NTupleTrainer(network, seed=7)
+        trainer.train(2, checkpoint_every=2, log_every=2)
+        # Games after the checkpoint, then a crash: nothing is written
+        trainer.train_game()
+        trainer.train_game()
+        network.close()
+
+        network = NTupleNetwork.open(resumed)
+        self.assertEqual(network.games, 2)
+        network.close()
+        self.train(resumed, 4, checkpoint_every=2)
+
+        with open(whole, "rb") as a, open(resumed, "rb") as b:
+            self.assertEqual(a.read(), b.read())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,322 @@
+import argparse
+import importlib
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import bitboard
+from persistence import JsonStore
+from rng import RngStream
+
+# Plays many games with one policy on a process pool and aggregates the
+# results while they stream in, in constant memory:
+#
+#   python tournament.py --policy greedy --games 1000000 --output runs/greedy
+#
+# writes every game to runs/greedy.csv as it finishes and the aggregates with
+# the progress to runs/greedy.json. Running the same command again resumes an
+# interrupted run from its last checkpoint.
+#
+# A policy is a function policy(board, moves, rng) returning a direction:
+# board is the packed bitboard (see bitboard.py), moves the legal moves as
+# (direction, new board, score gained) tuples, rng a random.Random. Besides
+# the built-in 'random' and 'greedy', any "module:function" can be used.
+
+# Games per task sent to a worker
+CHUNK_SIZE = 100
+
+# Seconds between two checkpoints
+CHECKPOINT_INTERVAL = 10.0
+
+# Tiles whose reach rate is reported
+GOALS = (2048, 4096, 8192)
+
+def random_policy(board, moves, rng):
+    return moves[rng.randrange(0, len(moves))][0]
+
+# Highest immediate score, then most empty cells
+def greedy_policy(board, moves, rng):
+    return max(moves, key=lambda move: (move[2], bitboard.count_empty(move[1])))[0]
+
+POLICIES = {
+    'random': random_policy,
+    'greedy': greedy_policy,
+}
+
+_loaded_policies = {}
+
+# Policy function from its name, 'random', 'greedy' or "module:function"
+def load_policy(name):
+    policy = POLICIES.get(name) or _loaded_policies.get(name)
+    if policy is None:
+        module_name, sep, function = name.partition(":")
+        if not sep:
+            raise ValueError(f"Unknown policy {name!r}, expected one of {sorted(POLICIES)} or module:function")
+        policy = _loaded_policies[name] = getattr(importlib.import_module(module_name), function)
+    return policy
+
+# Play one game to the end, returns (score, max tile, moves)
+def play_game(policy, rng):
+    board = bitboard.spawn(bitboard.spawn(0, rng, first=True), rng, first=True)
+    score = 0
+    count = 0
+    while True:
+        moves = []
+        for direction in bitboard.DIRECTIONS:
+            new, gained, moved = bitboard.move(board, direction)
+            if moved: moves.append( (direction, new, gained) )
+        if not moves: break
+        direction = policy(board, moves, rng)
+        for move in moves:
+            if move[0] == direction: break
+        else:
+            raise ValueError(f"The policy chose {direction!r}, which is not a legal move")
+        board = bitboard.spawn(move[1], rng)
+        score += move[2]
+        count += 1
+    return score, bitboard.max_tile(board), count
+
+# Worker task: games first to first + count - 1, each with its own RNG stream so a
+# seed gives the same games whatever the number of workers.
+# Returns (chunk index, [(game, score, max tile, moves), ...])
+def play_chunk(policy_name, seed, chunk, first, count):
+    policy = load_policy(policy_name)
+    results = []
+    for game in range(first, first + count):
+        results.append( (game,) + play_game(policy, RngStream(seed, game)) )
+    return chunk, results
+
+# Mean and variance in one pass (Welford's algorithm)
+class RunningStats:
+
+    def __init__(self, count=0, mean=0.0, m2=0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def as_dict(self):
+        return {"count": self.count, "mean": self.mean, "m2": self.m2}
+
+# Quantiles of positive values with a bounded relative error (a DDSketch):
+# values are counted in logarithmic buckets, bucket i holding the values in
+# (gamma ** (i - 1), gamma ** i]. The number of buckets only grows with the
+# logarithm of the largest value, about 700 for scores up to 10**6 at 1%.
+class QuantileSketch:
+
+    def __init__(self, relative_accuracy=0.01, buckets=None, zeros=0):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {int(key): count for key, count in (buckets or {}).items()}
+        self.zeros = zeros
+        self.count = zeros + sum(self.buckets.values())
+
+    def add(self, value):
+        self.count += 1
+        if value <= 0:
+            self.zeros += 1
+            return
+        key = math.ceil(math.log(value) / self.log_gamma)
+        self.buckets[key] = self.buckets.get(key, 0) + 1
+
+    # Value below which the share q of the values fall, within the relative accuracy
+    def quantile(self, q):
+        if self.count == 0: return 0.0
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen: return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def as_dict(self):
+        return {"relative_accuracy": self.relative_accuracy, "buckets": dict(self.buckets), "zeros": self.zeros}
+
+# Everything reported about a run, updated one game at a time
+class Aggregates:
+
+    def __init__(self, state=None):
+        state = state or {}
+        self.score = RunningStats(**state.get("score", {}))
+        self.moves = RunningStats(**state.get("moves", {}))
+        self.sketch = QuantileSketch(**state.get("sketch", {}))
+        self.max_tiles = {int(tile): count for tile, count in state.get("max_tiles", {}).items()}
+
+    def add(self, score, max_tile, moves):
+        self.score.add(score)
+        self.moves.add(moves)
+        self.sketch.add(score)
+        self.max_tiles[max_tile] = self.max_tiles.get(max_tile, 0) + 1
+
+    # Share of the games that reached a tile
+    def reach_rate(self, tile):
+        reached = sum(count for max_tile, count in self.max_tiles.items() if max_tile >= tile)
+        return reached / self.score.count if self.score.count else 0.0
+
+    def as_dict(self):
+        return {"score": self.score.as_dict(), "moves": self.moves.as_dict(),
+                "sketch": self.sketch.as_dict(), "max_tiles": dict(self.max_tiles)}
+
+    def summary(self):
+        return {
+            "games": self.score.count,
+            "mean_score": self.score.mean,
+            "stdev_score": math.sqrt(self.score.variance()),
+            "mean_moves": self.moves.mean,
+            "quantiles": {str(q): self.sketch.quantile(q) for q in (0.01, 0.1, 0.5, 0.9, 0.99)},
+            "reach_rates": {str(tile): self.reach_rate(tile) for tile in GOALS},
+        }
+
+    def report(self):
+        summary = self.summary()
+        quantiles = summary["quantiles"]
+        rates = ", ".join(f"{tile} {rate:.2%}" for tile, rate in summary["reach_rates"].items())
+        return (f"{summary['games']} games, score mean {summary['mean_score']:.1f} "
+                f"(sd {summary['stdev_score']:.1f}), p10 {quantiles['0.1']:.0f}, "
+                f"p50 {quantiles['0.5']:.0f}, p90 {quantiles['0.9']:.0f}, p99 {quantiles['0.99']:.0f}; reached {rates}")
+
+class Tournament:
+
+    # output is the path prefix of the results (.csv) and checkpoint (.json) files
+    def __init__(self, policy, games, output, seed=0, workers=None, chunk_size=CHUNK_SIZE,
+                 checkpoint_interval=CHECKPOINT_INTERVAL):
+        load_policy(policy)
+        self.policy = policy
+        self.games = games
+        self.seed = seed
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.checkpoint_interval = checkpoint_interval
+        self.chunks = (games + chunk_size - 1) // chunk_size
+        self.results_path = output + ".csv"
+        self.store = JsonStore(output + ".json", flush_interval=0)
+        self.last_checkpoint = time.monotonic()
+        self.config = {"policy": policy, "games": games, "seed": seed, "chunk_size": chunk_size}
+
+        # Chunks below next_chunk are all done, done holds the ones finished out of order
+        self.next_chunk = 0
+        self.done = set()
+        self.aggregates = Aggregates()
+        self.results_size = 0
+        if os.path.exists(self.store.path): self.resume()
+
+    # Load the last checkpoint of a run with the same settings
+    def resume(self):
+        state = self.store.load()
+        if state.get("config") != self.config:
+            raise ValueError(f"{self.store.path} belongs to another run: {state.get('config')}")
+        self.next_chunk = state["next_chunk"]
+        self.done = set(state["done"])
+        self.aggregates = Aggregates(state["aggregates"])
+        self.results_size = state["results_size"]
+        print(f"Resuming after {self.aggregates.score.count} games")
+
+    # Chunks still to play, in order
+    def pending(self):
+        for chunk in range(self.next_chunk, self.chunks):
+            if chunk not in self.done: yield chunk
+
+    def task(self, chunk):
+        first = chunk * self.chunk_size
+        return (self.policy, self.seed, chunk, first, min(self.chunk_size, self.games - first))
+
+    # Take the results of a chunk in, returns the number of games
+    def collect(self, chunk, results, file):
+        for game, score, max_tile, moves in results:
+            self.aggregates.add(score, max_tile, moves)
+            file.write(f"{game},{score},{max_tile},{moves}\n")
+        self.done.add(chunk)
+        while self.next_chunk in self.done:
+            self.done.remove(self.next_chunk)
+            self.next_chunk += 1
+        return len(results)
+
+    # Save the progress every checkpoint interval (now if forced). The results
+    # file is synced first and its size kept, so a resumed run cuts off the
+    # games written after the checkpoint.
+    def checkpoint(self, file, force=False):
+        if not force and time.monotonic() - self.last_checkpoint < self.checkpoint_interval:
+            return False
+        file.flush()
+        os.fsync(file.fileno())
+        self.store.update({
+            "config": self.config,
+            "next_chunk": self.next_chunk,
+            "done": sorted(self.done),
+            "results_size": file.tell(),
+            "aggregates": self.aggregates.as_dict(),
+            "summary": self.aggregates.summary(),
+        })
+        self.store.flush()
+        self.last_checkpoint = time.monotonic()
+        return True
+
+    def run(self):
+        start = time.perf_counter()
+        played = 0
+        mode = "r+" if os.path.exists(self.results_path) else "w"
+        with open(self.results_path, mode) as file:
+            file.seek(self.results_size)
+            file.truncate()
+            if self.results_size == 0: file.write("game,score,max_tile,moves\n")
+
+            if self.workers == 1:
+                for chunk in self.pending():
+                    played += self.collect(*play_chunk(*self.task(chunk)), file)
+                    if self.checkpoint(file): self.progress(start, played)
+            else:
+                with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                    # A bounded number of chunks in flight keeps the memory constant
+                    window = 4 * (self.workers or os.cpu_count() or 1)
+                    running = set()
+                    for chunk in self.pending():
+                        running.add(pool.submit(play_chunk, *self.task(chunk)))
+                        if len(running) < window: continue
+                        finished, running = wait(running, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            played += self.collect(*future.result(), file)
+                        if self.checkpoint(file): self.progress(start, played)
+                    for future in running:
+                        played += self.collect(*future.result(), file)
+            self.checkpoint(file, force=True)
+        print(self.aggregates.report())
+        print(f"{played} games played in {time.perf_counter() - start:.1f} s, {self.aggregates.score.count} in total")
+        return self.aggregates
+
+    def progress(self, start, played):
+        print(f"{played / (time.perf_counter() - start):.0f} games/s, {self.aggregates.report()}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play many games with one policy and aggregate the results")
+    parser.add_argument("--policy", default="random", help="'random', 'greedy' or module:function")
+    parser.add_argument("--games", type=int, default=10000)
+    parser.add_argument("--output", required=True, metavar="PREFIX", help="writes PREFIX.csv (every game) and PREFIX.json (checkpoint and aggregates)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None, help="processes (all cores by default, 1 runs in this process)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="games per worker task")
+    parser.add_argument("--checkpoint-interval", type=float, default=CHECKPOINT_INTERVAL, help="seconds between two checkpoints")
+    args = parser.parse_args(argv)
+
+    try:
+        tournament = Tournament(args.policy, args.games, args.output, args.seed, args.workers,
+                                args.chunk_size, args.checkpoint_interval)
+    except (ValueError, ImportError, AttributeError) as error:
+        parser.error(str(error))
+    tournament.run()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
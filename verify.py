@@ -0,0 +1,277 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+
+from core import GameCore, DIRECTIONS, ENGINES, ROWS, MAX_SIZE
+from rng import RngStream
+
+# Differential check of the move engines against the reference: the original
+# cell by cell engine ('array', GameCore.__move_and_merge). Two checks:
+#
+#   rows:  every 4x4 line of tile exponents, slid in every direction as a row
+#          and as a column, exhaustively (4x4 boards only)
+#   games: seeded random games played move by move by every engine at once;
+#          after every move and every new tile the boards, scores, moved
+#          flags and game over flags have to be the same
+#
+# The first board where an engine disagrees is printed. Game N of a seed
+# always gets the same RNG streams (rng.RngStream(seed, N)), whatever the
+# number of workers, so a reported game can be played again on its own.
+#
+#   python verify.py --games 100000 --workers 8
+
+REFERENCE = 'array'
+
+# Games per worker task
+CHUNK_SIZE = 200
+
+# Seconds between two progress lines
+PROGRESS_INTERVAL = 10.0
+
+# Largest tile exponent an engine can merge, the bitboard cells have 4 bits
+# so two 32768 tiles (exponent 15) don't merge there
+MAX_MERGE_EXPONENT = {'bitboard': 14}
+
+# Side by side text of a few boards, each one under its title
+def format_boards(titles, boards):
+    width = max(len(title) for title in titles)
+    width = max(width, max(6 * len(row) for board in boards for row in board))
+    lines = ["   ".join(title.ljust(width) for title in titles)]
+    for rows in zip(*boards):
+        lines.append("   ".join("".join(f"{value:6}" for value in row).ljust(width) for row in rows))
+    return "\n".join(lines)
+
+# A board where an engine disagrees with the reference
+class Mismatch:
+
+    def __init__(self, engine, key, where, before, expected, got):
+        self.engine = engine
+        # Order of the mismatches, (game, move, step) in games
+        self.key = key
+        # Text telling where it happened, e.g. "game 12, move 40 (LEFT)"
+        self.where = where
+        # Board before the step, and (tiles, score, moved, game over) after it from both engines
+        self.before = before
+        self.expected = expected
+        self.got = got
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+    def report(self):
+        (tiles, score, moved, over), (got_tiles, got_score, got_moved, got_over) = self.expected, self.got
+        titles, boards = [REFERENCE, self.engine], [tiles, got_tiles]
+        if self.before is not None: titles, boards = ["before"] + titles, [self.before] + boards
+        lines = [f"{self.engine} disagrees with {REFERENCE} at {self.where}:", format_boards(titles, boards)]
+        for name, a, b in (("score", score, got_score), ("moved", moved, got_moved), ("game over", over, got_over)):
+            if a != b: lines.append(f"{name}: {REFERENCE} {a}, {self.engine} {b}")
+        return "\n".join(lines)
+
+# What is compared after every step
+def state(core):
+    return core.tiles.tobytes(), core.score, core.generate, core.is_game_over()
+
+def readable(core):
+    return core.tiles.tolist(), core.score, core.generate, core.is_game_over()
+
+# The first engine whose state differs from the reference (cores[0]), None if all agree
+def compare(engines, cores, key, where, before):
+    expected = state(cores[0])
+    for engine, core in zip(engines[1:], cores[1:]):
+        if state(core) != expected:
+            return Mismatch(engine, key, where, before, readable(cores[0]), readable(core))
+    return None
+
+# Play game number game of a seed with the reference and every engine, a
+# random move at a time (moves that don't change the board included).
+# Returns (moves played, Mismatch or None).
+def play_game(engines, size, seed, game, max_moves):
+    engines = (REFERENCE,) + tuple(engines)
+    cores = [GameCore(engine, rows=size, cols=size) for engine in engines]
+    stream = RngStream(seed, game)
+    # Every engine spawns from its own copy of the same stream
+    for core in cores: core.rng = stream.split("spawn")
+    choices = stream.split("moves")
+
+    for core in cores:
+        for _ in range(2): core.generate_tiles(True)
+    mismatch = compare(engines, cores, (game, 0, 0), f"game {game}, start", None)
+    if mismatch is not None: return 0, mismatch
+
+    move = 0
+    for move in range(1, max_moves + 1):
+        before = cores[0].tiles.tolist()
+        direction = DIRECTIONS[choices.randrange(4)]
+        for core in cores: core.slide_tiles(direction)
+        mismatch = compare(engines, cores, (game, move, 0), f"game {game}, move {move} ({direction})", before)
+        if mismatch is not None: return move, mismatch
+
+        if not cores[0].generate: continue
+        before = cores[0].tiles.tolist()
+        for core in cores:
+            core.generate_tiles()
+            core.generate = False
+        mismatch = compare(engines, cores, (game, move, 1), f"game {game}, new tile after move {move}", before)
+        if mismatch is not None: return move, mismatch
+        if cores[0].is_game_over(): break
+    return move, None
+
+# Worker task: games first to first + count - 1, stops at the first mismatch.
+# Returns (games played, moves played, Mismatch or None)
+def verify_chunk(engines, size, seed, first, count, max_moves):
+    moves = 0
+    for game in range(first, first + count):
+        played, mismatch = play_game(engines, size, seed, game, max_moves)
+        moves += played
+        if mismatch is not None: return game - first + 1, moves, mismatch
+    return count, moves, None
+
+# The 4 line codes of a board as rows: code bits 4 * col are the exponent of column col
+def rows_board(codes):
+    return np.array([[1 << ((code >> 4 * col) & 0xF) if (code >> 4 * col) & 0xF else 0 for col in range(4)]
+                     for code in codes], dtype=np.int64)
+
+# Slide every 4 cell line of exponents 0..15 (65536 of them) as a row and
+# as a column in all 4 directions, 4 lines per board, and compare the
+# engines. Engines with a MAX_MERGE_EXPONENT only get the lines within it.
+# Returns (slides compared, Mismatch or None).
+def check_rows(engines):
+    cores = {engine: GameCore(engine) for engine in (REFERENCE,) + tuple(engines)}
+    limits = {engine: MAX_MERGE_EXPONENT.get(engine, 15) for engine in engines}
+    # Lines grouped by their largest exponent, so every engine gets whole boards of lines it supports
+    by_limit = {}
+    for code in range(65536):
+        by_limit.setdefault(max((code >> shift) & 0xF for shift in (0, 4, 8, 12)), []).append(code)
+    slides = 0
+    for largest in sorted(by_limit):
+        codes = by_limit[largest]
+        codes += [0] * (-len(codes) % 4)
+        targets = [engine for engine in engines if largest <= limits[engine]]
+        if not targets: continue
+        compared = (REFERENCE,) + tuple(targets)
+        for i in range(0, len(codes), 4):
+            board = rows_board(codes[i:i + 4])
+            for tiles in (board, board.T.copy()):
+                for direction in DIRECTIONS:
+                    results = {}
+                    for engine in compared:
+                        core = cores[engine]
+                        core.tiles = tiles.copy()
+                        core.score = 0
+                        core.generate = False
+                        core.slide_tiles(direction)
+                        results[engine] = core
+                    slides += len(targets)
+                    where = (f"line codes {', '.join(f'{code:#06x}' for code in codes[i:i + 4])} "
+                             f"{'as columns' if tiles is not board else 'as rows'}, {direction}")
+                    mismatch = compare(compared, [results[engine] for engine in compared], (largest, i), where, tiles.tolist())
+                    if mismatch is not None: return slides, mismatch
+    return slides, None
+
+class Verifier:
+
+    # Plays games first to first + games - 1 of the seed
+    def __init__(self, engines, games, seed=0, size=ROWS, workers=None, chunk_size=CHUNK_SIZE, max_moves=100000, first=0):
+        self.engines = tuple(engines)
+        self.games = games
+        self.first = first
+        self.seed = seed
+        self.size = size
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.max_moves = max_moves
+        self.played = 0
+        self.moves = 0
+        self.mismatches = []
+        self.last_progress = time.monotonic()
+
+    def tasks(self):
+        end = self.first + self.games
+        for first in range(self.first, end, self.chunk_size):
+            yield (self.engines, self.size, self.seed, first, min(self.chunk_size, end - first), self.max_moves)
+
+    def collect(self, result):
+        played, moves, mismatch = result
+        self.played += played
+        self.moves += moves
+        if mismatch is not None: self.mismatches.append(mismatch)
+
+    def progress(self, start):
+        if time.monotonic() - self.last_progress < PROGRESS_INTERVAL: return
+        self.last_progress = time.monotonic()
+        elapsed = time.perf_counter() - start
+        print(f"{self.played} games, {self.played / elapsed:.0f} games/s, {self.moves / elapsed:.0f} moves/s")
+
+    # Play the games, returns the first Mismatch (lowest game) or None
+    def run(self):
+        start = time.perf_counter()
+        if self.workers == 1:
+            for task in self.tasks():
+                self.collect(verify_chunk(*task))
+                if self.mismatches: break
+                self.progress(start)
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                # A bounded number of chunks in flight; after a mismatch no new
+                # chunk starts, the ones before it finish so the lowest game is reported
+                window = 4 * (self.workers or os.cpu_count() or 1)
+                running = set()
+                for task in self.tasks():
+                    running.add(pool.submit(verify_chunk, *task))
+                    if len(running) < window: continue
+                    finished, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished: self.collect(future.result())
+                    if self.mismatches: break
+                    self.progress(start)
+                for future in running: self.collect(future.result())
+        elapsed = time.perf_counter() - start
+        print(f"{self.played} games, {self.moves} moves in {elapsed:.1f} s "
+              f"({self.played / elapsed:.0f} games/s, {self.moves / elapsed:.0f} moves/s)")
+        return min(self.mismatches) if self.mismatches else None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=f"Check the move engines against the reference '{REFERENCE}' engine")
+    parser.add_argument("--engines", nargs="+", choices=[e for e in ENGINES if e != REFERENCE], help="engines checked (all by default)")
+    parser.add_argument("--games", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--first", type=int, default=0, metavar="GAME", help="number of the first game played")
+    parser.add_argument("--size", type=int, default=ROWS, choices=range(2, MAX_SIZE + 1), metavar="N", help="board size of the games")
+    parser.add_argument("--workers", type=int, default=None, help="processes (all cores by default, 1 runs in this process)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="games per worker task")
+    parser.add_argument("--max-moves", type=int, default=100000, help="moves after which a game is cut off")
+    parser.add_argument("--no-rows", action="store_true", help="skip the exhaustive line check")
+    args = parser.parse_args(argv)
+    if args.max_moves < 1: parser.error("--max-moves must be at least 1")
+
+    engines = args.engines or [e for e in ENGINES if e != REFERENCE]
+    if args.size != ROWS:
+        if args.engines and 'bitboard' in args.engines:
+            parser.error(f"the bitboard engine only plays {ROWS}x{ROWS} boards")
+        engines = [e for e in engines if e != 'bitboard']
+
+    if not args.no_rows and args.size == ROWS:
+        start = time.perf_counter()
+        slides, mismatch = check_rows(engines)
+        print(f"Lines: {slides} slides compared in {time.perf_counter() - start:.1f} s"
+              + "".join(f", {e} up to exponent {MAX_MERGE_EXPONENT[e]}" for e in engines if e in MAX_MERGE_EXPONENT))
+        if mismatch is not None:
+            print(mismatch.report())
+            return 1
+
+    if args.games:
+        mismatch = Verifier(engines, args.games, args.seed, args.size, args.workers, args.chunk_size,
+                            args.max_moves, args.first).run()
+        if mismatch is not None:
+            print(mismatch.report())
+            print(f"Play it again with: python verify.py --first {mismatch.key[0]} --games 1 --seed {args.seed} "
+                  f"--size {args.size} --no-rows")
+            return 1
+    print(f"{', '.join(engines)}: no disagreement with {REFERENCE}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())